@@ -1,79 +1,1957 @@
 from flask import Flask, request, jsonify, send_file, render_template
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import requests
 import os
+import sys
 from dotenv import load_dotenv
 import json
 import threading
+import queue
+import logging
+import contextvars
+from collections import deque, OrderedDict, Counter
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только внутри процесса
+    fcntl = None
+try:
+    import orjson
+except ImportError:  # Без orjson ответы сериализуются стандартным json
+    orjson = None
+try:
+    import brotli
+except ImportError:  # Без brotli ответы сжимаются только gzip
+    brotli = None
 import time
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill
 import io
+import gzip
 import pickle
 from datetime import datetime
 import math
+import mmap
+import bisect
+from array import array
+import html
+import hashlib
+import tempfile
+import uuid
+import random
+from difflib import SequenceMatcher
+import re
+import sqlite3
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from collections import namedtuple
 
 # Загружаем переменные окружения
 # ПРИМЕЧАНИЕ: Файл .env существует в проекте и содержит актуальные ключи API
 load_dotenv()
 
+# Логирование: уровни, отдельные логгеры для компонентов и кольцевой буфер событий по задачам
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FEATURE_SAMPLE = int(os.getenv('LOG_FEATURE_SAMPLE', 10))  # В DEBUG выводится каждая N-я организация
+JOB_LOG_SIZE = int(os.getenv('JOB_LOG_SIZE', 200))
+JOB_LOG_JOBS = int(os.getenv('JOB_LOG_JOBS', 50))  # Для скольких последних задач хранятся события
+
+# Идентификатор задачи, к которой относятся сообщения текущего потока
+current_job = contextvars.ContextVar('current_job', default='-')
+
+class JobContextFilter(logging.Filter):
+    """Добавляет в запись лога идентификатор текущей задачи"""
+    def filter(self, record):
+        record.job = current_job.get()
+        return True
+
+class JobLogBuffer(logging.Handler):
+    """Хранит последние JOB_LOG_SIZE событий каждой из JOB_LOG_JOBS последних задач в памяти"""
+    def __init__(self, size=JOB_LOG_SIZE, max_jobs=JOB_LOG_JOBS):
+        super().__init__(level=logging.INFO)
+        self.size = size
+        self.max_jobs = max_jobs
+        self.buffers = OrderedDict()
+    
+    def emit(self, record):
+        job = getattr(record, 'job', '-')
+        if job == '-':
+            return
+        try:
+            event = {
+                'time': datetime.fromtimestamp(record.created).isoformat(timespec='seconds'),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage()
+            }
+        except Exception:
+            self.handleError(record)
+            return
+        buffer = self.buffers.get(job)
+        if buffer is None:
+            buffer = self.buffers[job] = deque(maxlen=self.size)
+            while len(self.buffers) > self.max_jobs:
+                self.buffers.popitem(last=False)
+        buffer.append(event)
+    
+    def get_events(self, job, limit=None):
+        self.acquire()
+        try:
+            events = list(self.buffers.get(job, ()))
+        finally:
+            self.release()
+        return events[-limit:] if limit else events
+
+job_log_buffer = JobLogBuffer()
+
+def configure_logging():
+    """Настраивает вывод логов приложения один раз на процесс"""
+    base_logger = logging.getLogger('resort_search')
+    if base_logger.handlers:
+        return
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(job)s] %(message)s'))
+    for handler in (stream_handler, job_log_buffer):
+        handler.addFilter(JobContextFilter())
+        base_logger.addHandler(handler)
+    base_logger.setLevel(LOG_LEVEL)
+    base_logger.propagate = False
+
+configure_logging()
+api_logger = logging.getLogger('resort_search.api')
+search_logger = logging.getLogger('resort_search.search')
+email_logger = logging.getLogger('resort_search.email')
+http_logger = logging.getLogger('resort_search.http')
+cache_logger = logging.getLogger('resort_search.cache')
+storage_logger = logging.getLogger('resort_search.storage')
+
+# Ответы API: минимальный размер тела для сжатия (байты), уровни gzip и brotli,
+# объем кэша готовых (сериализованных и сжатых) тел ответов в каждом воркере (мегабайты)
+API_COMPRESS_MIN_SIZE = int(os.getenv('API_COMPRESS_MIN_SIZE', 1024))
+API_GZIP_LEVEL = int(os.getenv('API_GZIP_LEVEL', 6))
+API_BROTLI_QUALITY = int(os.getenv('API_BROTLI_QUALITY', 5))
+API_BODY_CACHE_MAX_MB = float(os.getenv('API_BODY_CACHE_MAX_MB', 32))
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON для ответов Flask: orjson, если он установлен, иначе стандартный json.
+    
+    Кириллица выводится как UTF-8 без экранирования, ключи не сортируются.
+    """
+    ensure_ascii = False
+    sort_keys = False
+    
+    def encode(self, obj):
+        """Компактный JSON в байтах UTF-8"""
+        if orjson is None:
+            return self.dumps(obj, separators=(',', ':')).encode('utf-8')
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.encode(obj).decode('utf-8')
+    
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        body = self.encode(self._prepare_response_obj(args, kwargs)) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+class EncodedBodyCache:
+    """LRU-кэш готовых тел ответов (байты и кодировка сжатия) с ограничением общего объема"""
+    def __init__(self, max_bytes=int(API_BODY_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+    
+    def put(self, key, body, encoding):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous:
+                self.size -= len(previous[0])
+            if len(body) > self.max_bytes:
+                return
+            self.entries[key] = (body, encoding)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+encoded_body_cache = EncodedBodyCache()
+
+def negotiate_encoding():
+    """Кодировка сжатия по Accept-Encoding запроса: 'br' (если установлен brotli), 'gzip' или None"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] and accepted['br'] >= accepted['gzip']:
+        return 'br'
+    return 'gzip' if accepted['gzip'] else None
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=API_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=API_GZIP_LEVEL, mtime=0)
+
+def encode_body(payload, encoding):
+    """Тело JSON-ответа и фактическая кодировка: тела меньше API_COMPRESS_MIN_SIZE не сжимаются"""
+    body = app.json.encode(payload)
+    if encoding and len(body) >= API_COMPRESS_MIN_SIZE:
+        return compress_body(body, encoding), encoding
+    return body, None
+
+def body_response(body, encoding):
+    """Ответ с готовым телом JSON (сжатым, если указана кодировка)"""
+    response = app.response_class(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
-# Глобальные переменные для управления процессами
-current_processes = {
-    'search_names': False,
-    'search_emails': False
-}
+@app.after_request
+def compress_response(response):
+    """Сжимает большие JSON-ответы API, если клиент поддерживает gzip или brotli"""
+    if (response.mimetype != 'application/json' or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.status_code != 200):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    body = response.get_data()
+    if encoding is None or len(body) < API_COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое тело отличается побайтно, поэтому ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
-organizations_data = []
+# Виды задач; состояние задач хранится в реестре job_registry, общем для всех воркеров
+JOB_KINDS = ('search_names', 'search_emails')
 
 # Маршрут для главной страницы
 @app.route('/')
 def index():
     return render_template('index.html')
 
-# Функции для работы с файловым хранилищем
-def save_organizations_data(data, city):
-    """Сохраняет данные организаций в файл"""
-    try:
-        filename = f"data_{city.replace(' ', '_')}.pkl"
-        filepath = os.path.join('exports', filename)
-        
-        # Создаем директорию если не существует
-        os.makedirs('exports', exist_ok=True)
-        
-        with open(filepath, 'wb') as f:
-            pickle.dump(data, f)
-        print(f"💾 Данные сохранены в файл: {filepath}")
-        return filepath
-    except Exception as e:
-        print(f"❌ Ошибка сохранения данных: {e}")
-        return None
+# Функции для работы с хранилищем организаций
+def dataset_name_from_request(city='', coordinates='', radius='5'):
+    """Имя набора данных по параметрам запроса: город или координаты «широта,долгота» и радиус"""
+    if coordinates:
+        coords_parts = str(coordinates).split(',')
+        if len(coords_parts) == 2:
+            lat, lon = float(coords_parts[0]), float(coords_parts[1])
+            return f"coords_{lat:.4f}_{lon:.4f}_r{radius}"
+    return city
+
+def latest_dataset_name():
+    """Набор данных последнего успешного поиска организаций этого клиента (в любом воркере)"""
+    job = job_registry.latest('search_names', state='completed', client=client_id())
+    return job['dataset'] if job else None
 
-def load_organizations_data(city):
-    """Загружает данные организаций из файла"""
+def load_organizations_data(city, use_cache=True):
+    """Загружает организации набора данных (старые pkl-файлы импортируются в хранилище при первом обращении).
+    
+    Читается снимок текущей версии поиска, а если его нет — хранилище. Наборы
+    кэшируются в памяти до изменения поиска: возвращаемый список общий для
+    запросов и не должен изменяться. Для изменения записей — use_cache=False.
+    """
     try:
-        filename = f"data_{city.replace(' ', '_')}.pkl"
-        filepath = os.path.join('exports', filename)
+        version = organization_store.search_version(city)
+        if use_cache:
+            data = dataset_cache.get(city, version)
+            if data is not None:
+                return data
+        snapshot = dataset_snapshots.get(city, version)
+        data = snapshot.select() if snapshot else organization_store.load_search(city)
+        if data is not None:
+            storage_logger.debug("📂 Данные загружены из хранилища: %s, количество: %s", city, len(data))
+            if use_cache:
+                dataset_cache.put(city, version, data)
+            return data
         
+        filepath = os.path.join('exports', f"data_{city.replace(' ', '_')}.pkl")
         if os.path.exists(filepath):
             with open(filepath, 'rb') as f:
-                data = pickle.load(f)
-            print(f"📂 Данные загружены из файла: {filepath}, количество: {len(data)}")
+                data = [Organization.from_dict(org) for org in pickle.load(f)]
+            organization_store.save_search(city, data)
+            storage_logger.info("📂 Импортирован файл %s в хранилище: %s организаций", filepath, len(data))
             return data
-        else:
-            print(f"📂 Файл не найден: {filepath}")
-            return []
+        storage_logger.debug("📂 Набор данных не найден: %s", city)
+        return []
     except Exception as e:
-        print(f"❌ Ошибка загрузки данных: {e}")
+        storage_logger.error("❌ Ошибка загрузки данных: %s", e)
         return []
 
+# Максимальный размер страницы /api/get_organizations (без limit возвращается весь набор)
+ORGANIZATIONS_PAGE_MAX = int(os.getenv('ORGANIZATIONS_PAGE_MAX', 1000))
+
+# Контрольные точки поиска email: найденные адреса записываются в хранилище после каждых N результатов
+EMAIL_CHECKPOINT_EVERY = int(os.getenv('EMAIL_CHECKPOINT_EVERY', 20))
+
+# Параметры HTTP-соединений с внешними API (Яндекс, 2GIS, ProxyAPI)
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', 0.5))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', 8))
+
+class UpstreamTransport:
+    """Общий транспорт для внешних API: одна keep-alive сессия с пулом соединений на хост,
+    раздельные таймауты подключения и чтения, повторы с экспоненциальной задержкой"""
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    
+    def __init__(self, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, max_retries=HTTP_MAX_RETRIES,
+                 backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sessions = {}
+        self.lock = threading.Lock()
+    
+    def session_for(self, url):
+        """Возвращает сессию для хоста (создает при первом обращении)"""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                # Повторы выполняем сами, чтобы учитывать флаг остановки
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount(host, adapter)
+                self.sessions[host] = session
+            return session
+    
+    def backoff_delay(self, attempt, response=None):
+        """Задержка перед повтором: Retry-After или экспонента с джиттером"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+    
+    def request(self, method, url, read_timeout=None, stop_flag=None, **kwargs):
+        """Выполняет запрос с повторами при 429/5xx и обрывах соединения"""
+        session = self.session_for(url)
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+                http_logger.warning("🔁 %s: статус %s, повтор %s/%s", urlsplit(url).netloc, response.status_code, attempt + 1, self.max_retries)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                http_logger.warning("🔁 %s: %s, повтор %s/%s", urlsplit(url).netloc, type(e).__name__, attempt + 1, self.max_retries)
+            
+            deadline = time.monotonic() + self.backoff_delay(attempt, response)
+            while time.monotonic() < deadline:
+                if stop_flag and stop_flag():
+                    if response is not None:
+                        return response
+                    raise requests.ConnectionError('Процесс остановлен во время ожидания повтора')
+                time.sleep(min(0.1, max(deadline - time.monotonic(), 0)))
+    
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+http_transport = UpstreamTransport()
+
+# Параметры кэша ответов Яндекс API (время жизни в секундах для каждого типа запроса)
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', os.path.join('exports', 'response_cache.sqlite3'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 20000))
+RESPONSE_CACHE_TTL = {
+    'search': int(os.getenv('RESPONSE_CACHE_TTL_SEARCH', 24 * 3600)),
+    'details': int(os.getenv('RESPONSE_CACHE_TTL_DETAILS', 7 * 24 * 3600)),
+    'geocode': int(os.getenv('RESPONSE_CACHE_TTL_GEOCODE', 30 * 24 * 3600)),
+}
+
+class CachedResponse:
+    """Успешный ответ API с уже разобранным JSON (из кэша или из сети)"""
+    status_code = 200
+    
+    def __init__(self, data, from_cache=False):
+        self.data = data
+        self.from_cache = from_cache
+    
+    def json(self):
+        return self.data
+
+class SQLiteStore:
+    """Основа для хранилищ в SQLite: отдельное соединение на поток, режим WAL и схема из SCHEMA"""
+    SCHEMA = []
+    # Изменения схемы для баз, созданных прежними версиями (ошибка «колонка уже есть» игнорируется)
+    MIGRATIONS = []
+    
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {}
+    
+    def connection(self):
+        """Соединение с базой для текущего потока"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            for statement in self.MIGRATIONS:
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError:
+                    pass
+            conn.commit()
+            self.local.conn = conn
+        return conn
+    
+    def count(self, name, outcome):
+        """Счетчики попаданий и промахов по имени (тип запроса, вид записи)"""
+        with self.lock:
+            values = self.stats.setdefault(name, {'hits': 0, 'misses': 0})
+            values[outcome] += 1
+    
+    def get_stats(self):
+        with self.lock:
+            return {name: dict(values) for name, values in self.stats.items()}
+
+class ResponseCache(SQLiteStore):
+    """Дисковый кэш ответов API в SQLite с TTL по типу запроса и LRU-вытеснением"""
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            body TEXT NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)',
+    ]
+    # Параметры, которые не влияют на ответ и не должны попадать в ключ
+    EXCLUDED_PARAMS = {'apikey', 'key'}
+    EVICT_EVERY = 100
+    
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=None):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.ttl = ttl or RESPONSE_CACHE_TTL
+        self.puts = 0
+    
+    def make_key(self, endpoint, params):
+        """Ключ кэша: тип запроса и нормализованные параметры без API ключа"""
+        normalized = {}
+        for name, value in params.items():
+            if name in self.EXCLUDED_PARAMS:
+                continue
+            if name in ('ll', 'spn', 'geocode'):
+                # Координаты округляем до 6 знаков, чтобы одинаковые точки давали один ключ
+                try:
+                    value = ','.join(f"{float(part):.6f}" for part in str(value).split(','))
+                except ValueError:
+                    pass
+            normalized[name] = re.sub(r'\s+', ' ', str(value).strip().lower())
+        return f"{endpoint}:{json.dumps(normalized, sort_keys=True, ensure_ascii=False)}"
+    
+    def get(self, endpoint, params):
+        """Возвращает сохраненный JSON или None, если записи нет или она устарела"""
+        try:
+            key = self.make_key(endpoint, params)
+            conn = self.connection()
+            row = conn.execute('SELECT body, created FROM responses WHERE key = ?', (key,)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl.get(endpoint, 0):
+                self.count(endpoint, 'misses')
+                return None
+            conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            conn.commit()
+            self.count(endpoint, 'hits')
+            return json.loads(row[0])
+        except Exception as e:
+            cache_logger.warning("⚠️ Ошибка чтения кэша ответов: %s", e)
+            return None
+    
+    def put(self, endpoint, params, data):
+        """Сохраняет JSON ответа и при необходимости вытесняет давно неиспользуемые записи"""
+        try:
+            key = self.make_key(endpoint, params)
+            now = time.time()
+            conn = self.connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, endpoint, body, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, endpoint, json.dumps(data, ensure_ascii=False), now, now)
+            )
+            conn.commit()
+            with self.lock:
+                self.puts += 1
+                evict = self.puts % self.EVICT_EVERY == 0
+            if evict:
+                self.evict()
+        except Exception as e:
+            cache_logger.warning("⚠️ Ошибка записи в кэш ответов: %s", e)
+    
+    def evict(self):
+        """Удаляет устаревшие записи и самые давно использованные сверх лимита"""
+        conn = self.connection()
+        now = time.time()
+        for endpoint, ttl in self.ttl.items():
+            conn.execute('DELETE FROM responses WHERE endpoint = ? AND created < ?', (endpoint, now - ttl))
+        excess = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)',
+                (excess,)
+            )
+        conn.commit()
+
+response_cache = ResponseCache()
+
+# Параметры параллельного поиска по типам организаций
+SEARCH_MAX_WORKERS = int(os.getenv('YANDEX_SEARCH_MAX_WORKERS', 4))
+SEARCH_RATE_LIMIT = float(os.getenv('YANDEX_SEARCH_RPS', 5))
+SEARCH_RATE_BURST = float(os.getenv('YANDEX_SEARCH_BURST', SEARCH_RATE_LIMIT))
+# Общий для воркеров ограничитель частоты: каталог состояния и параметры адаптации
+RATE_LIMIT_DIR = os.getenv('RATE_LIMIT_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+RATE_LIMIT_MIN_FRACTION = float(os.getenv('RATE_LIMIT_MIN_FRACTION', 0.1))
+RATE_LIMIT_INCREASE_FRACTION = float(os.getenv('RATE_LIMIT_INCREASE_FRACTION', 0.05))
+# Постраничная выборка: размер страницы и максимум результатов на один тип
+SEARCH_PAGE_SIZE = int(os.getenv('YANDEX_SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_RESULTS_PER_TYPE = int(os.getenv('YANDEX_SEARCH_MAX_RESULTS_PER_TYPE', 100))
+# Разбиение области поиска по координатам: минимальная половина стороны тайла и лимит тайлов на тип
+SEARCH_MIN_TILE_KM = float(os.getenv('YANDEX_SEARCH_MIN_TILE_KM', 0.25))
+SEARCH_MAX_TILES_PER_TYPE = int(os.getenv('YANDEX_SEARCH_MAX_TILES_PER_TYPE', 64))
+# Сколько секунд область, полностью просмотренная ранее, считается актуальной и не запрашивается повторно
+SEARCH_COVERAGE_TTL = int(os.getenv('YANDEX_SEARCH_COVERAGE_TTL', 7 * 24 * 3600))
+# Глубина деления круга на тайлы для отделения просмотренных частей (каждый уровень — до 4x тайлов)
+SEARCH_COVERAGE_DEPTH = int(os.getenv('YANDEX_SEARCH_COVERAGE_DEPTH', 2))
+
+KM_PER_DEGREE = 111.0
+
+# Квадратный тайл области поиска: смещение центра от центра поиска (км) и половина стороны (км)
+SearchTile = namedtuple('SearchTile', ['x_km', 'y_km', 'half_km'])
+
+def tile_center(tile, lon, lat):
+    """Возвращает координаты (долгота, широта) центра тайла"""
+    tile_lat = lat + tile.y_km / KM_PER_DEGREE
+    tile_lon = lon + tile.x_km / (KM_PER_DEGREE * abs(math.cos(math.radians(lat))))
+    return tile_lon, tile_lat
+
+def split_tile(tile, radius):
+    """Делит тайл на четыре, отбрасывая части, которые не пересекают круг поиска"""
+    half = tile.half_km / 2
+    children = []
+    for dx in (-half, half):
+        for dy in (-half, half):
+            child = SearchTile(tile.x_km + dx, tile.y_km + dy, half)
+            # Расстояние от центра круга до ближайшей точки квадрата
+            nearest_x = max(abs(child.x_km) - half, 0.0)
+            nearest_y = max(abs(child.y_km) - half, 0.0)
+            if math.hypot(nearest_x, nearest_y) <= radius:
+                children.append(child)
+    return children
+
+def to_local_km(point_lon, point_lat, lon, lat):
+    """Смещение точки (км по осям x, y) относительно центра поиска"""
+    return ((point_lon - lon) * KM_PER_DEGREE * abs(math.cos(math.radians(lat))),
+            (point_lat - lat) * KM_PER_DEGREE)
+
+def tile_covered(tile, radius, circle):
+    """Проверяет, что часть тайла внутри круга поиска целиком лежит в ранее просмотренном круге.
+    
+    circle — (x_km, y_km, радиус) в локальных координатах. Дальняя от центра circle точка
+    пересечения оценивается сверху: не дальше самого дальнего угла тайла и не дальше круга поиска.
+    """
+    cx, cy, covered_radius = circle
+    farthest_corner = max(math.hypot(tile.x_km + dx - cx, tile.y_km + dy - cy)
+                          for dx in (-tile.half_km, tile.half_km) for dy in (-tile.half_km, tile.half_km))
+    return min(farthest_corner, math.hypot(cx, cy) + radius) <= covered_radius
+
+def tile_intersects(tile, circle):
+    cx, cy, covered_radius = circle
+    nearest_x = max(abs(tile.x_km - cx) - tile.half_km, 0.0)
+    nearest_y = max(abs(tile.y_km - cy) - tile.half_km, 0.0)
+    return math.hypot(nearest_x, nearest_y) < covered_radius
+
+def plan_tiles(radius, circles, depth=SEARCH_COVERAGE_DEPTH):
+    """Тайлы круга поиска, которые еще нужно запросить, с учетом ранее просмотренных кругов.
+    
+    Тайл, частично пересекающий просмотренный круг, делится (не глубже depth уровней
+    и не мельче SEARCH_MIN_TILE_KM), чтобы запрашивать только непросмотренные части.
+    Глубина ограничена: узкий непросмотренный серп вдоль границы дешевле запросить
+    несколькими крупными тайлами, чем десятками мелких.
+    """
+    planned = []
+    queue = deque([(SearchTile(0.0, 0.0, float(radius)), 0)])
+    while queue:
+        tile, level = queue.popleft()
+        if any(tile_covered(tile, radius, circle) for circle in circles):
+            continue
+        if (level < depth and tile.half_km / 2 >= SEARCH_MIN_TILE_KM
+                and any(tile_intersects(tile, circle) for circle in circles)):
+            queue.extend((child, level + 1) for child in split_tile(tile, radius))
+        else:
+            planned.append(tile)
+    return planned
+
+def distance_km(lon1, lat1, lon2, lat2):
+    """Расстояние между двумя точками по формуле гаверсинусов"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+class SharedTokenBucket:
+    """Ограничитель частоты запросов в виде «ведра токенов», общего для всех воркеров.
+    
+    Состояние (токены, текущая частота, время обновления) хранится в файле
+    RATE_LIMIT_DIR под блокировкой flock, поэтому все процессы gunicorn
+    расходуют одну квоту ключа. Частота подстраивается: при 403/429 она
+    уменьшается вдвое (не ниже min_rate), после успешных ответов плавно
+    возвращается к max_rate.
+    """
+    def __init__(self, name, key, max_rate, burst=None, min_rate=None, directory=None):
+        self.max_rate = max(float(max_rate), 0.001)
+        self.min_rate = min_rate or self.max_rate * RATE_LIMIT_MIN_FRACTION
+        self.burst = max(float(burst or self.max_rate), 1.0)
+        self.increase_step = self.max_rate * RATE_LIMIT_INCREASE_FRACTION
+        key_hash = hashlib.sha1((key or '').encode('utf-8')).hexdigest()[:12]
+        directory = directory or RATE_LIMIT_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"resort_search_rate_{name}_{key_hash}.json")
+        # Блокировка внутри процесса нужна и там, где flock недоступен
+        self.lock = threading.Lock()
+    
+    def update(self, change):
+        """Атомарно читает состояние, применяет change(state, now) и сохраняет результат"""
+        with self.lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                raw = b''
+                while True:
+                    chunk = os.read(fd, 4096)
+                    if not chunk:
+                        break
+                    raw += chunk
+                now = time.time()
+                try:
+                    state = json.loads(raw) if raw else None
+                except ValueError:
+                    state = None
+                if not state:
+                    state = {'tokens': self.burst, 'rate': self.max_rate, 'updated': now}
+                # Пополняем ведро за прошедшее время
+                elapsed = max(now - state['updated'], 0.0)
+                state['tokens'] = min(self.burst, state['tokens'] + elapsed * state['rate'])
+                state['updated'] = now
+                result = change(state, now)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, json.dumps(state).encode('utf-8'))
+                return result
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+    
+    def acquire(self, stop_flag=None):
+        """Забирает токен, дожидаясь его при необходимости.
+        Возвращает False, если процесс остановлен во время ожидания"""
+        def take(state, now):
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return 0.0
+            return (1 - state['tokens']) / state['rate']
+        
+        while True:
+            if stop_flag and stop_flag():
+                return False
+            delay = self.update(take)
+            if delay <= 0:
+                return True
+            time.sleep(min(delay, 0.1))
+    
+    def penalize(self):
+        """Ответ 403/429: снижаем частоту вдвое и опустошаем ведро"""
+        def slow_down(state, now):
+            state['rate'] = max(self.min_rate, state['rate'] / 2)
+            state['tokens'] = min(state['tokens'], 0.0)
+            return state['rate']
+        rate = self.update(slow_down)
+        http_logger.warning("🐢 Частота запросов снижена до %.2f в секунду (%s)", rate, os.path.basename(self.path))
+    
+    def reward(self):
+        """Успешный ответ: постепенно возвращаем частоту к максимальной"""
+        def speed_up(state, now):
+            state['rate'] = min(self.max_rate, state['rate'] + self.increase_step)
+        self.update(speed_up)
+
+# Поиск почти-дубликатов: расстояние в метрах (0 — отключено) и порог сходства названия/адреса
+DEDUP_NEAR_DISTANCE_M = float(os.getenv('DEDUP_NEAR_DISTANCE_M', 50))
+DEDUP_SIMILARITY = float(os.getenv('DEDUP_SIMILARITY', 0.85))
+
+# Сокращения в адресах: «улица Морская 5» и «ул. Морская, 5» приводятся к одному виду
+ADDRESS_ABBREVIATIONS = [
+    (r'\bулица\b', 'ул'),
+    (r'\bпроспект\b', 'пр-т'),
+    (r'\bпереулок\b', 'пер'),
+    (r'\bбульвар\b', 'б-р'),
+    (r'\bшоссе\b', 'ш'),
+    (r'\bнабережная\b', 'наб'),
+    (r'\bплощадь\b', 'пл'),
+    (r'\bпроезд\b', 'пр-д'),
+    (r'\bмикрорайон\b', 'мкр'),
+    (r'\bпосёлок\b|\bпоселок\b', 'п'),
+    (r'\bгород\b', 'г'),
+    (r'\bдом\b', 'д'),
+    (r'\bкорпус\b', 'к'),
+    (r'\bстроение\b', 'стр'),
+]
+
+def normalize_address(address):
+    """Нормализует адрес для сравнения: регистр, сокращения, знаки препинания и пробелы"""
+    address = (address or '').lower().replace('ё', 'е')
+    address = re.sub(r'[.,;:"«»()]', ' ', address)
+    for pattern, replacement in ADDRESS_ABBREVIATIONS:
+        address = re.sub(pattern, replacement, address)
+    return re.sub(r'\s+', ' ', address).strip()
+
+def normalize_name(name):
+    """Нормализует название организации: регистр, кавычки и знаки препинания"""
+    name = (name or '').lower().replace('ё', 'е')
+    name = re.sub(r'[^\w\s]', ' ', name)
+    return re.sub(r'\s+', ' ', name).strip()
+
+def normalize_website(website):
+    """Нормализует адрес сайта: без схемы, www и завершающего слэша"""
+    website = (website or '').strip().lower()
+    website = re.sub(r'^[a-z]+://', '', website)
+    if website.startswith('www.'):
+        website = website[4:]
+    return website.rstrip('/')
+
+def placeholder_website(name):
+    """Сайт-заглушка, который подставляется организациям без сайта в ответе API"""
+    return f"https://{(name or '')[:15].replace(' ', '').lower()}.ru"
+
+def intern_string(value):
+    """Интернирует строку, чтобы одинаковые значения (тип, город) хранились в памяти один раз"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Organization:
+    """Компактная запись об организации.
+    
+    Поля хранятся в слотах, координаты — числами (lon, lat), повторяющиеся
+    тип и город интернированы. Для совместимости поддерживается доступ как
+    к словарю (org['name'], org.get('email')); в API и экспорт запись
+    попадает через to_dict() и to_row().
+    """
+    __slots__ = ('name', 'lon', 'lat', 'yandex_id', 'full_address', 'website', 'email', 'type', 'city')
+    FIELDS = ('name', 'coordinates', 'yandex_id', 'full_address', 'website', 'email', 'type', 'city')
+    
+    def __init__(self, name='', coordinates=None, yandex_id='', full_address='', website='', email='', type=None, city=None):
+        self.name = name or ''
+        self.coordinates = coordinates
+        self.yandex_id = yandex_id or ''
+        self.full_address = full_address or ''
+        self.website = website or ''
+        self.email = email or ''
+        self.type = intern_string(type)
+        self.city = intern_string(city)
+    
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        return cls(*(data.get(field) for field in cls.FIELDS))
+    
+    @property
+    def coordinates(self):
+        return [self.lon, self.lat] if self.lon is not None else []
+    
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        if coordinates and len(coordinates) >= 2:
+            self.lon, self.lat = float(coordinates[0]), float(coordinates[1])
+        else:
+            self.lon = self.lat = None
+    
+    @property
+    def known_website(self):
+        """Сайт из ответа API; пустая строка, если вместо него подставлена заглушка"""
+        if not self.website or self.website == placeholder_website(self.name):
+            return ''
+        return self.website
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'coordinates': [self.lon, self.lat] if self.lon is not None else [],
+            'yandex_id': self.yandex_id,
+            'full_address': self.full_address,
+            'website': self.website,
+            'email': self.email,
+            'type': self.type,
+            'city': self.city,
+        }
+    
+    def to_row(self):
+        """Строка для экспорта: название, «широта, долгота», ID, адрес, сайт, email, тип, город"""
+        coords = f"{self.lat:.6f}, {self.lon:.6f}" if self.lon is not None else ''
+        return (self.name, coords, self.yandex_id, self.full_address, self.website, self.email, self.type or '', self.city or '')
+    
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, intern_string(value) if key in ('type', 'city') else value)
+    
+    def __contains__(self, key):
+        return key in self.FIELDS
+    
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+    
+    def __eq__(self, other):
+        if not isinstance(other, Organization):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return f"Organization({self.name!r}, yandex_id={self.yandex_id!r}, type={self.type!r})"
+
+class NearDuplicateDetector:
+    """Поиск почти-дубликатов через сетку ячеек размером distance_m.
+    
+    Новая организация сравнивается только с организациями из своей и соседних
+    ячеек: дубликатом считается точка ближе distance_m с похожим названием
+    или адресом (SequenceMatcher не ниже similarity).
+    
+    Сетка задана в градусах и одна на весь детектор: шаг по долготе считается
+    по широте первой точки. На других широтах соседних ячеек просматривается
+    столько, сколько занимает distance_m.
+    """
+    def __init__(self, distance_m=DEDUP_NEAR_DISTANCE_M, similarity=DEDUP_SIMILARITY):
+        self.distance_km = distance_m / 1000.0
+        self.similarity = similarity
+        self.cells = {}
+        self.lat_step = self.distance_km / KM_PER_DEGREE
+        self.lon_step = None
+    
+    @staticmethod
+    def lon_degrees(distance_km, lat):
+        """Сколько градусов долготы занимает distance_km на широте lat"""
+        return distance_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    
+    def cell(self, lon, lat):
+        """Ячейка сетки для точки"""
+        if self.lon_step is None:
+            self.lon_step = self.lon_degrees(self.distance_km, lat)
+        return int(math.floor(lon / self.lon_step)), int(math.floor(lat / self.lat_step))
+    
+    def is_similar(self, first, second):
+        if not first or not second:
+            return False
+        # Разные номера домов или корпусов («Морская 5» и «Морская 7») — разные организации
+        if re.findall(r'\d+', first) != re.findall(r'\d+', second):
+            return False
+        return SequenceMatcher(None, first, second).ratio() >= self.similarity
+    
+    def find(self, lon, lat, name, address):
+        """Возвращает похожую запись из соседних ячеек или None"""
+        cx, cy = self.cell(lon, lat)
+        reach = max(1, math.ceil(self.lon_degrees(self.distance_km, lat) / self.lon_step))
+        for dx in range(-reach, reach + 1):
+            for dy in (-1, 0, 1):
+                for other in self.cells.get((cx + dx, cy + dy), ()):
+                    if distance_km(lon, lat, other[0], other[1]) > self.distance_km:
+                        continue
+                    if self.is_similar(name, other[2]) or self.is_similar(address, other[3]):
+                        return other
+        return None
+    
+    def add(self, lon, lat, name, address):
+        self.cells.setdefault(self.cell(lon, lat), []).append((lon, lat, name, address))
+
+class OrganizationIndex:
+    """Инкрементальный индекс для удаления дубликатов за O(1) на организацию.
+    
+    Организация считается дубликатом, если уже встречались ее Yandex ID,
+    нормализованный адрес или нормализованный сайт из ответа API, а также если рядом
+    (DEDUP_NEAR_DISTANCE_M) уже есть организация с похожим названием или адресом.
+    Один индекс можно использовать для всех типов, тайлов и областей одного поиска.
+    """
+    def __init__(self, near_distance_m=DEDUP_NEAR_DISTANCE_M):
+        self.ids = set()
+        self.addresses = set()
+        self.websites = set()
+        self.near = NearDuplicateDetector(near_distance_m) if near_distance_m > 0 else None
+        self.duplicates = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def id_key(org):
+        """Ключ по ID; для сгенерированных ID — название и координаты"""
+        yandex_id = org.yandex_id
+        if yandex_id and not yandex_id.startswith('yandex_'):
+            return yandex_id
+        coords = (org.lon, org.lat) if org.lon is not None else ()
+        return (org.name.strip().lower(), tuple(round(c, 6) for c in coords))
+    
+    def add(self, org):
+        """Добавляет организацию в индекс. Возвращает False, если это дубликат"""
+        id_key = self.id_key(org)
+        address = normalize_address(org.full_address)
+        website = normalize_website(org.known_website)
+        
+        use_near = self.near is not None and org.lon is not None
+        name = normalize_name(org.name) if use_near else ''
+        
+        with self.lock:
+            if id_key in self.ids or (address and address in self.addresses) or (website and website in self.websites):
+                self.duplicates += 1
+                return False
+            if use_near and self.near.find(org.lon, org.lat, name, address):
+                self.duplicates += 1
+                return False
+            self.ids.add(id_key)
+            if address:
+                self.addresses.add(address)
+            if website:
+                self.websites.add(website)
+            if use_near:
+                self.near.add(org.lon, org.lat, name, address)
+            return True
+
+# Хранилище организаций и наборов данных (поисков) в SQLite
+ORGANIZATION_STORE_PATH = os.getenv('ORGANIZATION_STORE_PATH', os.path.join('exports', 'organizations.sqlite3'))
+# Размер ячейки пространственного индекса в градусах (0.01° ≈ 1 км)
+ORGANIZATION_STORE_CELL_DEG = float(os.getenv('ORGANIZATION_STORE_CELL_DEG', 0.01))
+
+class OrganizationStore(SQLiteStore):
+    """Общее хранилище организаций с индексами по Yandex ID, типу, городу и ячейке сетки.
+    
+    Каждая организация хранится один раз, поиск (набор данных) — это упорядоченный
+    список ссылок на организации, поэтому найденные email видны во всех поисках,
+    а перезапись поиска не трогает остальные. Тип и город, под которыми организация
+    попала в поиск, хранятся в его составе: другой поиск их не меняет. Изменение общей
+    записи увеличивает версии всех поисков с ней. Благодаря WAL чтение идет параллельно с записью.
+    """
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS organizations (
+            key TEXT PRIMARY KEY,
+            yandex_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT,
+            city TEXT,
+            lon REAL,
+            lat REAL,
+            cell_x INTEGER,
+            cell_y INTEGER,
+            full_address TEXT NOT NULL,
+            website TEXT NOT NULL,
+            email TEXT NOT NULL,
+            updated REAL NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_organizations_yandex_id ON organizations(yandex_id)',
+        'CREATE INDEX IF NOT EXISTS idx_organizations_type ON organizations(type)',
+        'CREATE INDEX IF NOT EXISTS idx_organizations_city ON organizations(city)',
+        'CREATE INDEX IF NOT EXISTS idx_organizations_cell ON organizations(cell_x, cell_y)',
+        '''CREATE TABLE IF NOT EXISTS searches (
+            name TEXT PRIMARY KEY,
+            city TEXT,
+            lon REAL,
+            lat REAL,
+            radius REAL,
+            types TEXT,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            progress TEXT,
+            version INTEGER NOT NULL DEFAULT 0,
+            base_version INTEGER NOT NULL DEFAULT 0
+        )''',
+        '''CREATE TABLE IF NOT EXISTS search_members (
+            search TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            org_key TEXT NOT NULL,
+            type TEXT,
+            city TEXT,
+            PRIMARY KEY (search, position)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_search_members_org ON search_members(org_key)',
+        # Типы, под которыми организация приходила из API (в том числе отброшенная как дубликат)
+        '''CREATE TABLE IF NOT EXISTS organization_types (
+            org_key TEXT NOT NULL,
+            type TEXT NOT NULL,
+            PRIMARY KEY (org_key, type)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_organization_types_type ON organization_types(type)',
+        # Круги, в которых организации типа были получены полностью (без обрезки по лимитам)
+        '''CREATE TABLE IF NOT EXISTS coverage (
+            type TEXT NOT NULL,
+            lon REAL NOT NULL,
+            lat REAL NOT NULL,
+            radius REAL NOT NULL,
+            created REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_coverage_type ON coverage(type, created)',
+        # Версия хранилища: увеличивается при каждом изменении организаций или состава поисков
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+    ]
+    MIGRATIONS = [
+        'ALTER TABLE searches ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE searches ADD COLUMN base_version INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE organizations ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE search_members ADD COLUMN type TEXT',
+        'ALTER TABLE search_members ADD COLUMN city TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_organizations_version ON organizations(version)',
+    ]
+    # Поля организации в составе поиска: тип и город из состава, для старых записей — из организации
+    COLUMNS = ('o.yandex_id, o.name, COALESCE(m.type, o.type), COALESCE(m.city, o.city), '
+               'o.lon, o.lat, o.full_address, o.website, o.email')
+    ORGANIZATION_COLUMNS = 'o.yandex_id, o.name, o.type, o.city, o.lon, o.lat, o.full_address, o.website, o.email'
+    # Ограничение числа параметров в одном запросе SQLite
+    MAX_PARAMS = 500
+    
+    def __init__(self, path=ORGANIZATION_STORE_PATH, cell_deg=ORGANIZATION_STORE_CELL_DEG):
+        super().__init__(path)
+        self.cell_deg = cell_deg
+    
+    @staticmethod
+    def make_key(org):
+        """Ключ организации: Yandex ID, а для сгенерированных ID — название и координаты"""
+        key = OrganizationIndex.id_key(org)
+        if isinstance(key, tuple):
+            name, coords = key
+            return f"{name}@{','.join(f'{c:.6f}' for c in coords)}"
+        return key
+    
+    def cell(self, lon, lat):
+        return math.floor(lon / self.cell_deg), math.floor(lat / self.cell_deg)
+    
+    def to_row(self, org, now, version):
+        cell_x, cell_y = self.cell(org.lon, org.lat) if org.lon is not None else (None, None)
+        return (
+            self.make_key(org), org.yandex_id, org.name, org.type, org.city,
+            org.lon, org.lat, cell_x, cell_y, org.full_address, org.website, org.email, now, version,
+        )
+    
+    @staticmethod
+    def from_row(row):
+        yandex_id, name, org_type, city, lon, lat, full_address, website, email = row
+        org = Organization(name, None, yandex_id, full_address, website, email, org_type, city)
+        org.lon, org.lat = lon, lat
+        return org
+    
+    def upsert(self, conn, organizations, version):
+        """Пакетная вставка или обновление организаций; уже найденный email пустым не затирается.
+        
+        Тип и город существующей записи не меняются (они хранятся в составе поисков),
+        обновляются только записи с изменившимися данными. Их версия становится
+        version, а поиски с ними получают ту же версию.
+        """
+        now = time.time()
+        conn.executemany(
+            '''INSERT INTO organizations (key, yandex_id, name, type, city, lon, lat, cell_x, cell_y,
+                                          full_address, website, email, updated, version)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   yandex_id = excluded.yandex_id, name = excluded.name,
+                   city = COALESCE(organizations.city, excluded.city), lon = excluded.lon, lat = excluded.lat,
+                   cell_x = excluded.cell_x, cell_y = excluded.cell_y, full_address = excluded.full_address,
+                   website = excluded.website, updated = excluded.updated, version = excluded.version,
+                   email = CASE WHEN excluded.email != '' THEN excluded.email ELSE organizations.email END
+               WHERE organizations.yandex_id IS NOT excluded.yandex_id OR organizations.name IS NOT excluded.name
+                  OR organizations.lon IS NOT excluded.lon OR organizations.lat IS NOT excluded.lat
+                  OR organizations.full_address IS NOT excluded.full_address
+                  OR organizations.website IS NOT excluded.website
+                  OR (organizations.city IS NULL AND excluded.city IS NOT NULL)
+                  OR (excluded.email != '' AND excluded.email IS NOT organizations.email)''',
+            [self.to_row(org, now, version) for org in organizations]
+        )
+        conn.execute(
+            'UPDATE searches SET version = ? WHERE name IN (SELECT m.search FROM search_members m '
+            'JOIN organizations o ON o.key = m.org_key WHERE o.version = ?)',
+            (version, version)
+        )
+    
+    def save_search(self, name, organizations, city=None, center=None, radius=None, types=None, duplicates=None,
+                    coverage=None):
+        """Сохраняет организации и заменяет состав поиска одной транзакцией.
+        
+        duplicates — организации, отброшенные поиском как дубликаты: в поиск они не входят,
+        но сохраняются вместе со своим типом, чтобы повторный поиск по этому типу их нашел.
+        coverage — полностью просмотренные круги (см. add_coverage): записываются в той же
+        транзакции, поэтому круг не считается просмотренным раньше, чем в хранилище появятся
+        его организации.
+        """
+        conn = self.connection()
+        keys = [self.make_key(org) for org in organizations]
+        duplicates = duplicates or []
+        lon, lat = center if center else (None, None)
+        with conn:
+            version = self.bump_version(conn)
+            self.upsert(conn, organizations + duplicates, version)
+            conn.executemany(
+                'INSERT OR IGNORE INTO organization_types (org_key, type) VALUES (?, ?)',
+                [(self.make_key(org), org.type) for org in organizations + duplicates if org.type]
+            )
+            if coverage:
+                self.add_coverage(conn, coverage)
+            conn.execute('DELETE FROM search_members WHERE search = ?', (name,))
+            conn.executemany(
+                'INSERT INTO search_members (search, position, org_key, type, city) VALUES (?, ?, ?, ?, ?)',
+                [(name, position, key, org.type, org.city)
+                 for position, (key, org) in enumerate(zip(keys, organizations))]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO searches (name, city, lon, lat, radius, types, size, created, progress, '
+                'version, base_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?)',
+                (name, city, lon, lat, radius, json.dumps(types, ensure_ascii=False) if types else None,
+                 len(keys), time.time(), version, version)
+            )
+        storage_logger.info("💾 Данные сохранены в хранилище: %s (%s организаций)", name, len(keys))
+    
+    def load_search(self, name, types=None, offset=0, limit=None):
+        """Организации поиска в исходном порядке (с фильтром по типам и окном); None, если поиска нет"""
+        conn = self.connection()
+        if conn.execute('SELECT 1 FROM searches WHERE name = ?', (name,)).fetchone() is None:
+            return None
+        query = (f"SELECT {self.COLUMNS} FROM search_members m JOIN organizations o ON o.key = m.org_key "
+                 "WHERE m.search = ?")
+        params = [name]
+        if types:
+            query += f" AND COALESCE(m.type, o.type) IN ({','.join('?' * len(types))})"
+            params.extend(types)
+        query += ' ORDER BY m.position LIMIT ? OFFSET ?'
+        params.extend([-1 if limit is None else limit, offset])
+        return [self.from_row(row) for row in conn.execute(query, params)]
+    
+    def update_emails(self, organizations):
+        """Записывает email организаций без перезаписи всего поиска; версии поисков с ними увеличиваются"""
+        if not organizations:
+            return
+        conn = self.connection()
+        now = time.time()
+        keys = [self.make_key(org) for org in organizations]
+        with conn:
+            version = self.bump_version(conn)
+            conn.executemany(
+                'UPDATE organizations SET email = ?, updated = ?, version = ? WHERE key = ?',
+                [(org.email, now, version, key) for org, key in zip(organizations, keys)]
+            )
+            for start in range(0, len(keys), self.MAX_PARAMS):
+                chunk = keys[start:start + self.MAX_PARAMS]
+                conn.execute(
+                    'UPDATE searches SET version = ? WHERE name IN '
+                    f"(SELECT search FROM search_members WHERE org_key IN ({','.join('?' * len(chunk))}))",
+                    [version, *chunk]
+                )
+    
+    @staticmethod
+    def bump_version(conn):
+        """Увеличивает общий счетчик версий в текущей транзакции и возвращает новое значение"""
+        conn.execute("INSERT INTO meta (key, value) VALUES ('version', 1) "
+                     "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+    
+    def changed_since(self, name, since):
+        """Организации поиска, измененные после версии since: [(позиция, организация)].
+        
+        None, если поиска нет или его состав был заменен после since (нужна полная загрузка).
+        """
+        conn = self.connection()
+        row = conn.execute('SELECT base_version FROM searches WHERE name = ?', (name,)).fetchone()
+        if row is None or row[0] > since:
+            return None
+        rows = conn.execute(
+            f"SELECT m.position, {self.COLUMNS} FROM search_members m JOIN organizations o ON o.key = m.org_key "
+            "WHERE m.search = ? AND o.version > ? ORDER BY m.position",
+            (name, since)
+        )
+        return [(row[0], self.from_row(row[1:])) for row in rows]
+    
+    def search_version(self, name):
+        """Версия поиска: меняется при любом изменении его состава или организаций; None, если поиска нет"""
+        row = self.connection().execute('SELECT version FROM searches WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+    
+    def save_progress(self, name, progress):
+        conn = self.connection()
+        with conn:
+            conn.execute('UPDATE searches SET progress = ? WHERE name = ?',
+                         (json.dumps(progress, ensure_ascii=False), name))
+    
+    def load_progress(self, name):
+        row = self.connection().execute('SELECT progress FROM searches WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+    
+    @staticmethod
+    def add_coverage(conn, coverage):
+        """Отмечает круги [(тип, долгота, широта, радиус, время просмотра)] как полностью просмотренные"""
+        conn.execute('DELETE FROM coverage WHERE created < ?', (time.time() - SEARCH_COVERAGE_TTL,))
+        conn.executemany('INSERT INTO coverage (type, lon, lat, radius, created) VALUES (?, ?, ?, ?, ?)',
+                         [(org_type, lon, lat, float(radius), created) for org_type, lon, lat, radius, created in coverage])
+    
+    def find_coverage(self, org_type, lon, lat, radius, max_age=SEARCH_COVERAGE_TTL):
+        """Свежие просмотренные круги типа, пересекающие круг поиска: [(долгота, широта, радиус, время)]"""
+        rows = self.connection().execute(
+            'SELECT lon, lat, radius, created FROM coverage WHERE type = ? AND created >= ? ORDER BY created DESC',
+            (org_type, time.time() - max_age)
+        ).fetchall()
+        return [row for row in rows if distance_km(lon, lat, row[0], row[1]) < row[2] + float(radius)]
+    
+    def organizations_in_circle(self, org_type, lon, lat, radius):
+        """Организации, найденные под типом, в круге: отбор по ячейкам сетки, затем точная проверка расстояния"""
+        lat_delta = float(radius) / KM_PER_DEGREE
+        lon_delta = float(radius) / (KM_PER_DEGREE * max(abs(math.cos(math.radians(lat))), 0.01))
+        min_x, min_y = self.cell(lon - lon_delta, lat - lat_delta)
+        max_x, max_y = self.cell(lon + lon_delta, lat + lat_delta)
+        rows = self.connection().execute(
+            f"SELECT {self.ORGANIZATION_COLUMNS} FROM organizations o "
+            "WHERE o.cell_x BETWEEN ? AND ? AND o.cell_y BETWEEN ? AND ? AND (o.type = ? OR EXISTS "
+            "(SELECT 1 FROM organization_types t WHERE t.org_key = o.key AND t.type = ?))",
+            (min_x, max_x, min_y, max_y, org_type, org_type)
+        ).fetchall()
+        organizations = [self.from_row(row) for row in rows]
+        return [org for org in organizations if org.lon is None or distance_km(lon, lat, org.lon, org.lat) <= float(radius)]
+
+organization_store = OrganizationStore()
+
+# Предел объема наборов данных, закэшированных в памяти каждого воркера (мегабайты)
+DATASET_CACHE_MAX_MB = float(os.getenv('DATASET_CACHE_MAX_MB', 64))
+
+class DatasetCache:
+    """LRU-кэш загруженных наборов данных в памяти процесса.
+    
+    Запись действительна, пока не изменилась версия поиска в хранилище,
+    поэтому изменения из других воркеров сразу видны. Общий объем наборов
+    ограничен max_bytes, давно не использованные вытесняются.
+    """
+    # Строковые поля записи (тип и город интернированы и в объеме не учитываются)
+    STRING_FIELDS = ('name', 'yandex_id', 'full_address', 'website', 'email')
+    
+    def __init__(self, max_bytes=int(DATASET_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # набор данных -> (версия, организации, объем)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    def estimate_size(self, organizations):
+        """Приблизительный объем набора в байтах"""
+        float_size = sys.getsizeof(0.0)
+        size = sys.getsizeof(organizations)
+        for org in organizations:
+            size += sys.getsizeof(org) + 2 * float_size
+            size += sum(sys.getsizeof(getattr(org, field)) for field in self.STRING_FIELDS)
+        return size
+    
+    def get(self, name, version):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != version:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(name)
+            self.stats['hits'] += 1
+            return entry[1]
+    
+    def put(self, name, version, organizations):
+        size = self.estimate_size(organizations)
+        with self.lock:
+            previous = self.entries.pop(name, None)
+            if previous:
+                self.size -= previous[2]
+            if size > self.max_bytes:
+                return
+            self.entries[name] = (version, organizations, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+    
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, datasets=len(self.entries), bytes=self.size)
+
+dataset_cache = DatasetCache()
+
+# Каталог снимков завершенных поисков (колоночный формат с отображением в память)
+DATASET_SNAPSHOT_DIR = os.getenv('DATASET_SNAPSHOT_DIR', os.path.join('exports', 'snapshots'))
+
+class DatasetSnapshot:
+    """Колоночный снимок набора данных, читаемый через mmap.
+    
+    Файл: сигнатура, длина и JSON-заголовок (число записей, словари типов
+    и городов, смещения колонок), затем выровненные колонки: координаты —
+    массивы double, тип и город — коды uint16, строковые поля — массив
+    смещений uint64 и общий блок UTF-8. Записи создаются только для
+    запрошенных строк, подсчеты по типам читают одну колонку кодов.
+    """
+    MAGIC = b'ORGSNAP1'
+    STRING_FIELDS = ('name', 'yandex_id', 'full_address', 'website', 'email')
+    ALIGN = 8
+    
+    def __init__(self, path, version=None):
+        self.path = path
+        self.version = version
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError(f"Неверный формат снимка: {path}")
+        header_start = len(self.MAGIC) + 4
+        header_length = int.from_bytes(self.mm[len(self.MAGIC):header_start], 'little')
+        header = json.loads(self.mm[header_start:header_start + header_length])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"Снимок записан с другим порядком байтов: {path}")
+        self.count = header['count']
+        self.types = [intern_string(value) for value in header['types']]
+        self.cities = [intern_string(value) for value in header['cities']]
+        data_start = self.aligned(header_start + header_length)
+        view = memoryview(self.mm)
+        self.columns = {}
+        self.blobs = {}
+        for name, (offset, length, fmt) in header['columns'].items():
+            start = data_start + offset
+            if fmt == 's':
+                self.blobs[name] = start
+            else:
+                self.columns[name] = view[start:start + length].cast(fmt)
+    
+    @classmethod
+    def aligned(cls, position):
+        return (position + cls.ALIGN - 1) // cls.ALIGN * cls.ALIGN
+    
+    @classmethod
+    def write(cls, path, organizations):
+        """Записывает снимок атомарно (через временный файл)"""
+        types, cities = {}, {}
+        blocks = {
+            'lon': array('d', (math.nan if org.lon is None else org.lon for org in organizations)),
+            'lat': array('d', (math.nan if org.lat is None else org.lat for org in organizations)),
+            'type': array('H', (types.setdefault(org.type, len(types)) for org in organizations)),
+            'city': array('H', (cities.setdefault(org.city, len(cities)) for org in organizations)),
+        }
+        for field in cls.STRING_FIELDS:
+            encoded = [getattr(org, field).encode('utf-8') for org in organizations]
+            offsets = array('Q', [0])
+            total = 0
+            for value in encoded:
+                total += len(value)
+                offsets.append(total)
+            blocks[f'{field}_offsets'] = offsets
+            blocks[field] = b''.join(encoded)
+        
+        columns, chunks, position = {}, [], 0
+        for name, block in blocks.items():
+            data = block.tobytes() if isinstance(block, array) else block
+            columns[name] = (position, len(data), block.typecode if isinstance(block, array) else 's')
+            padding = cls.aligned(len(data)) - len(data)
+            chunks.append(data + b'\0' * padding)
+            position += len(data) + padding
+        header = json.dumps({
+            'count': len(organizations), 'byteorder': sys.byteorder,
+            'types': list(types), 'cities': list(cities), 'columns': columns,
+        }, ensure_ascii=False).encode('utf-8')
+        
+        prefix = cls.MAGIC + len(header).to_bytes(4, 'little') + header
+        prefix += b'\0' * (cls.aligned(len(prefix)) - len(prefix))
+        directory = os.path.dirname(path)
+        os.makedirs(directory or '.', exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(prefix)
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def __len__(self):
+        return self.count
+    
+    def materialize(self, positions):
+        """Записи Organization для строк с заданными номерами"""
+        mm, columns = self.mm, self.columns
+        lons, lats, type_codes, city_codes = columns['lon'], columns['lat'], columns['type'], columns['city']
+        types, cities = self.types, self.cities
+        strings = [(self.blobs[field], columns[f'{field}_offsets']) for field in self.STRING_FIELDS]
+        new = Organization.__new__
+        result = []
+        for index in positions:
+            org = new(Organization)
+            org.name, org.yandex_id, org.full_address, org.website, org.email = [
+                mm[start + offsets[index]:start + offsets[index + 1]].decode('utf-8') for start, offsets in strings
+            ]
+            lon = lons[index]
+            if lon == lon:  # NaN — координат нет
+                org.lon, org.lat = lon, lats[index]
+            else:
+                org.lon = org.lat = None
+            org.type, org.city = types[type_codes[index]], cities[city_codes[index]]
+            result.append(org)
+        return result
+    
+    def positions(self, types=None):
+        """Номера строк с заданными типами (все строки, если типы не заданы)"""
+        if not types:
+            return range(self.count)
+        codes = {code for code, value in enumerate(self.types) if value in types}
+        return [index for index, code in enumerate(self.columns['type']) if code in codes]
+    
+    def select(self, types=None, offset=0, limit=None):
+        """Организации в исходном порядке с фильтром по типам и окном, как OrganizationStore.load_search"""
+        positions = self.positions(types)
+        end = len(positions) if limit is None else offset + limit
+        return self.materialize(positions[offset:end])
+    
+    def select_page(self, types=None, matches=None, cursor=0, limit=None):
+        """Страница, как у select_page для списка: строки отбираются по колонке типов,
+        записи создаются только для проверки matches и для самой страницы"""
+        positions = self.positions(types)
+        start = bisect.bisect_left(positions, cursor)
+        if matches is None:
+            end = len(positions) if limit is None else start + limit
+            return self.materialize(positions[start:end]), (positions[end] if end < len(positions) else None)
+        page = []
+        chunk = max(limit or 0, 256)
+        for chunk_start in range(start, len(positions), chunk):
+            chunk_positions = positions[chunk_start:chunk_start + chunk]
+            for position, org in zip(chunk_positions, self.materialize(chunk_positions)):
+                if matches(org):
+                    if limit is not None and len(page) == limit:
+                        return page, position
+                    page.append(org)
+        return page, None
+    
+    def count_by_type(self):
+        """Число организаций каждого типа: читается только колонка кодов типов"""
+        counts = Counter(self.columns['type'])
+        return {self.types[code]: count for code, count in counts.items()}
+
+class DatasetSnapshots:
+    """Снимки поисков на диске: отдельный файл на каждую версию поиска.
+    
+    Снимок пишется после завершения задачи поиска или поиска email; пока версия
+    поиска не совпадает с версией снимка (идет поиск email), читается хранилище.
+    """
+    def __init__(self, directory=DATASET_SNAPSHOT_DIR):
+        self.directory = directory
+        self.opened = {}
+        self.lock = threading.Lock()
+    
+    def prefix(self, name):
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+    
+    def path(self, name, version):
+        return os.path.join(self.directory, f'{self.prefix(name)}.{version}.snap')
+    
+    def get(self, name, version):
+        """Открытый снимок нужной версии или None"""
+        if version is None:
+            return None
+        with self.lock:
+            snapshot = self.opened.get(name)
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+        path = self.path(name, version)
+        if not os.path.exists(path):
+            return None
+        try:
+            snapshot = DatasetSnapshot(path, version)
+        except (OSError, ValueError) as e:
+            storage_logger.warning("⚠️ Не удалось открыть снимок %s: %s", path, e)
+            return None
+        with self.lock:
+            self.opened[name] = snapshot
+        return snapshot
+    
+    def write(self, name):
+        """Записывает снимок текущей версии поиска и удаляет прежние"""
+        try:
+            version = organization_store.search_version(name)
+            organizations = organization_store.load_search(name)
+            if organizations is None:
+                return
+            path = self.path(name, version)
+            DatasetSnapshot.write(path, organizations)
+            for filename in os.listdir(self.directory):
+                if filename.startswith(self.prefix(name) + '.') and os.path.join(self.directory, filename) != path:
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except OSError:
+                        pass  # Windows: файл еще отображен в память другим воркером
+            storage_logger.info("💾 Снимок набора данных записан: %s (%s организаций)", name, len(organizations))
+        except Exception as e:
+            storage_logger.warning("⚠️ Не удалось записать снимок %s: %s", name, e)
+
+dataset_snapshots = DatasetSnapshots()
+
+# Реестр задач (поиск организаций, поиск email), общий для всех воркеров gunicorn
+JOB_REGISTRY_PATH = os.getenv('JOB_REGISTRY_PATH', os.path.join('exports', 'jobs.sqlite3'))
+# Как часто задача перечитывает флаг отмены из реестра (секунды)
+JOB_CANCEL_CHECK_INTERVAL = float(os.getenv('JOB_CANCEL_CHECK_INTERVAL', 0.5))
+# Сколько задач выполняется одновременно во всех воркерах; остальные ждут в очереди
+JOB_MAX_RUNNING = int(os.getenv('JOB_MAX_RUNNING', 2))
+# Как часто воркер проверяет очередь задач (секунды)
+JOB_DISPATCH_INTERVAL = float(os.getenv('JOB_DISPATCH_INTERVAL', 1.0))
+# Бюджет запросов к внешним API на одну задачу (0 — без ограничения)
+JOB_BUDGETS = {
+    'search_names': int(os.getenv('JOB_SEARCH_BUDGET', 1000)),
+    'search_emails': int(os.getenv('JOB_EMAIL_BUDGET', 300)),
+}
+# Оценка длительности задачи (секунды), пока нет статистики завершенных задач
+JOB_DEFAULT_DURATION = float(os.getenv('JOB_DEFAULT_DURATION', 60))
+# Сколько секунд хранятся события задач для потоков /api/events
+JOB_EVENTS_TTL = int(os.getenv('JOB_EVENTS_TTL', 3600))
+JOB_ACTIVE_STATES = ('queued', 'running')
+# Поля задачи, изменения которых публикуются событием 'job'
+JOB_EVENT_FIELDS = ('state', 'cancel', 'processed', 'total', 'found', 'error', 'spent')
+
+def pid_alive(pid):
+    """Проверяет, что процесс с таким PID существует"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def fair_order(queued, last_served):
+    """Порядок запуска задач из очереди: по кругу между клиентами, начиная с давно обслуженных.
+    
+    queued — задачи в порядке создания, last_served — {клиент: время запуска его последней задачи}.
+    """
+    by_client = {}
+    for job in queued:
+        by_client.setdefault(job['client'], deque()).append(job)
+    served = dict(last_served)
+    order = []
+    while by_client:
+        client = min(by_client, key=lambda c: (served.get(c) or 0.0, by_client[c][0]['created']))
+        order.append(by_client[client].popleft())
+        if not by_client[client]:
+            del by_client[client]
+        served[client] = time.time() + len(order)
+    return order
+
+class JobRegistry(SQLiteStore):
+    """Реестр задач в SQLite: ID, клиент, состояние, счетчики прогресса, бюджет и флаг отмены.
+    
+    Задача выполняется потоком одного воркера, а статус, остановка и данные
+    запрашиваются любым воркером, поэтому все состояние хранится в базе.
+    Задачи процессов, которые завершились аварийно, при чтении помечаются как failed.
+    Изменения задач записываются в журнал job_events, из которого читают потоки /api/events.
+    """
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            dataset TEXT,
+            state TEXT NOT NULL,
+            cancel INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            found INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            pid INTEGER,
+            params TEXT,
+            created REAL NOT NULL,
+            started REAL,
+            updated REAL NOT NULL,
+            finished REAL,
+            client TEXT NOT NULL DEFAULT '',
+            budget INTEGER NOT NULL DEFAULT 0,
+            spent INTEGER NOT NULL DEFAULT 0
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_kind_state ON jobs(kind, state)',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created)',
+        # Журнал событий задач: смена состояния, прогресс, найденные организации
+        '''CREATE TABLE IF NOT EXISTS job_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events(job, id)',
+    ]
+    MIGRATIONS = [
+        "ALTER TABLE jobs ADD COLUMN client TEXT NOT NULL DEFAULT ''",
+        'ALTER TABLE jobs ADD COLUMN budget INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE jobs ADD COLUMN spent INTEGER NOT NULL DEFAULT 0',
+    ]
+    FIELDS = ('id', 'kind', 'dataset', 'state', 'cancel', 'processed', 'total', 'found', 'error', 'pid',
+              'params', 'created', 'started', 'updated', 'finished', 'client', 'budget', 'spent')
+    
+    def __init__(self, path=JOB_REGISTRY_PATH):
+        super().__init__(path)
+    
+    def create(self, kind, dataset=None, params=None, client='', budget=0, exclusive=False):
+        """Ставит задачу в очередь и возвращает ее ID.
+        
+        С exclusive=True задача не создается (возвращается None), если уже активна задача того же вида
+        для того же набора данных; проверка и вставка выполняются в одной транзакции.
+        """
+        if exclusive:
+            # Сначала помечаем задачи аварийно завершившихся процессов, чтобы они не блокировали запуск
+            self.active(kind)
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if exclusive and conn.execute(
+                    f"SELECT 1 FROM jobs WHERE kind = ? AND dataset = ? AND state IN {JOB_ACTIVE_STATES} LIMIT 1",
+                    (kind, dataset)).fetchone():
+                conn.rollback()
+                return None
+            conn.execute(
+                'INSERT INTO jobs (id, kind, dataset, state, params, created, updated, client, budget) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, dataset, 'queued', json.dumps(params or {}, ensure_ascii=False),
+                 now, now, client, budget)
+            )
+            conn.execute('DELETE FROM job_events WHERE created < ?', (now - JOB_EVENTS_TTL,))
+            self.add_event(job_id, 'job', {'state': 'queued', 'kind': kind, 'dataset': dataset}, conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return job_id
+    
+    def claim_next(self, max_running=JOB_MAX_RUNNING):
+        """Забирает следующую задачу из очереди для текущего процесса, если есть свободное место"""
+        self.active()
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'running'").fetchone()[0]
+            queued = [self.to_dict(row) for row in conn.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM jobs WHERE state = 'queued' AND cancel = 0 ORDER BY created")]
+            if running >= max_running or not queued:
+                conn.rollback()
+                return None
+            job = fair_order(queued, self.last_served(conn))[0]
+            now = time.time()
+            conn.execute("UPDATE jobs SET state = 'running', started = ?, updated = ?, pid = ? WHERE id = ?",
+                         (now, now, os.getpid(), job['id']))
+            self.add_event(job['id'], 'job', {'state': 'running'}, conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        job.update(state='running', started=now, pid=os.getpid())
+        return job
+    
+    @staticmethod
+    def last_served(conn):
+        return dict(conn.execute('SELECT client, MAX(started) FROM jobs WHERE started IS NOT NULL GROUP BY client'))
+    
+    def update(self, job_id, **fields):
+        """Обновляет поля задачи (состояние, счетчики, набор данных)"""
+        fields['updated'] = time.time()
+        if fields.get('state') in ('completed', 'stopped', 'failed'):
+            fields.setdefault('finished', fields['updated'])
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        changes = {name: value for name, value in fields.items() if name in JOB_EVENT_FIELDS}
+        conn = self.connection()
+        with conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            if changes:
+                self.add_event(job_id, 'job', changes, conn)
+    
+    def finish(self, job_id, state, error=None):
+        self.update(job_id, state=state, error=error)
+    
+    def cancel(self, job_id=None, kind=None, client=None):
+        """Запрашивает остановку задачи по ID или активных задач вида (одного клиента); возвращает число задач.
+        
+        Задачи из очереди сразу помечаются как остановленные.
+        """
+        if job_id:
+            where, params = 'id = ?', [job_id]
+        else:
+            where, params = 'kind = ?', [kind]
+            if client is not None:
+                where, params = where + ' AND client = ?', params + [client]
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            affected = conn.execute(
+                f"SELECT id, state FROM jobs WHERE {where} AND state IN {JOB_ACTIVE_STATES}", params).fetchall()
+            conn.execute(
+                f"UPDATE jobs SET cancel = 1, updated = ? WHERE {where} AND state IN {JOB_ACTIVE_STATES}",
+                [now] + params)
+            conn.execute(
+                f"UPDATE jobs SET state = 'stopped', finished = ? WHERE {where} AND state = 'queued'",
+                [now] + params)
+            for affected_id, state in affected:
+                self.add_event(affected_id, 'job', {'cancel': True, 'state': 'stopped' if state == 'queued' else state}, conn)
+        return len(affected)
+    
+    def add_event(self, job_id, event, data, conn=None):
+        """Добавляет событие задачи в журнал (в транзакции conn, если она передана)"""
+        row = (job_id, event, json.dumps(data, ensure_ascii=False), time.time())
+        sql = 'INSERT INTO job_events (job, event, data, created) VALUES (?, ?, ?, ?)'
+        if conn is not None:
+            conn.execute(sql, row)
+            return
+        conn = self.connection()
+        with conn:
+            conn.execute(sql, row)
+    
+    def events(self, after_id, job_id=None, client=None, limit=500):
+        """События после after_id по задаче или по задачам клиента: [(id, задача, событие, данные)]"""
+        if job_id:
+            rows = self.connection().execute(
+                'SELECT id, job, event, data FROM job_events WHERE job = ? AND id > ? ORDER BY id LIMIT ?',
+                (job_id, after_id, limit))
+        else:
+            rows = self.connection().execute(
+                'SELECT e.id, e.job, e.event, e.data FROM job_events e JOIN jobs j ON j.id = e.job '
+                'WHERE e.id > ? AND j.client = ? ORDER BY e.id LIMIT ?',
+                (after_id, client, limit))
+        return [(event_id, job, event, json.loads(data)) for event_id, job, event, data in rows]
+    
+    def last_event_id(self):
+        return self.connection().execute('SELECT COALESCE(MAX(id), 0) FROM job_events').fetchone()[0]
+    
+    def is_cancelled(self, job_id):
+        row = self.connection().execute('SELECT cancel FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+    
+    def cancel_token(self, job_id):
+        """Функция-флаг остановки для потоков задачи; реестр опрашивается не чаще JOB_CANCEL_CHECK_INTERVAL"""
+        state = {'checked': 0.0, 'cancelled': False}
+        lock = threading.Lock()
+        
+        def stop_flag():
+            with lock:
+                now = time.monotonic()
+                if not state['cancelled'] and now - state['checked'] >= JOB_CANCEL_CHECK_INTERVAL:
+                    state['checked'] = now
+                    try:
+                        state['cancelled'] = self.is_cancelled(job_id)
+                    except sqlite3.Error as e:
+                        storage_logger.warning("⚠️ Ошибка чтения реестра задач: %s", e)
+                return state['cancelled']
+        return stop_flag
+    
+    def to_dict(self, row):
+        job = dict(zip(self.FIELDS, row))
+        job['cancel'] = bool(job['cancel'])
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        return job
+    
+    def select(self, where, params=()):
+        """Задачи по условию; выполняющиеся задачи завершившихся процессов помечаются как failed"""
+        rows = self.connection().execute(f"SELECT {', '.join(self.FIELDS)} FROM jobs WHERE {where}", params).fetchall()
+        jobs = []
+        for row in rows:
+            job = self.to_dict(row)
+            if job['state'] == 'running' and job['pid'] and not pid_alive(job['pid']):
+                storage_logger.warning("⚠️ Процесс %s задачи %s завершился, задача помечена как failed", job['pid'], job['id'])
+                job.update(state='failed', error='Процесс воркера завершился')
+                self.finish(job['id'], job['state'], job['error'])
+            jobs.append(job)
+        return jobs
+    
+    def get(self, job_id):
+        jobs = self.select('id = ?', (job_id,))
+        return jobs[0] if jobs else None
+    
+    def active(self, kind=None):
+        """Активные задачи (в очереди и выполняющиеся), от старых к новым"""
+        where, params = f"state IN {JOB_ACTIVE_STATES}", ()
+        if kind:
+            where, params = where + ' AND kind = ?', (kind,)
+        return [job for job in self.select(where + ' ORDER BY created', params) if job['state'] in JOB_ACTIVE_STATES]
+    
+    def latest(self, kind, state=None, client=None):
+        """Последняя задача вида (при необходимости — в заданном состоянии и от заданного клиента)"""
+        where, params = 'kind = ?', [kind]
+        if state:
+            where, params = where + ' AND state = ?', params + [state]
+        if client is not None:
+            where, params = where + ' AND client = ?', params + [client]
+        jobs = self.select(where + ' ORDER BY created DESC LIMIT 1', params)
+        return jobs[0] if jobs else None
+    
+    def average_durations(self, limit=20):
+        """Средняя длительность последних завершенных задач по видам (секунды)"""
+        durations = {}
+        for kind in JOB_BUDGETS:
+            rows = self.connection().execute(
+                "SELECT finished - started FROM jobs WHERE kind = ? AND state = 'completed' AND started IS NOT NULL "
+                'ORDER BY finished DESC LIMIT ?', (kind, limit)).fetchall()
+            if rows:
+                durations[kind] = sum(row[0] for row in rows) / len(rows)
+        return durations
+    
+    def queue_status(self, max_running=JOB_MAX_RUNNING):
+        """Глубина очереди и оценка времени старта каждой ожидающей задачи.
+        
+        Свободные места и оставшееся время выполняющихся задач моделируются по средней
+        длительности задач того же вида; задачи из очереди распределяются в порядке fair_order.
+        """
+        jobs = self.active()
+        running = [job for job in jobs if job['state'] == 'running']
+        queued = [job for job in jobs if job['state'] == 'queued']
+        durations = self.average_durations()
+        now = time.time()
+        slots = [max(durations.get(job['kind'], JOB_DEFAULT_DURATION) - (now - (job['started'] or now)), 0.0)
+                 for job in running]
+        slots += [0.0] * max(max_running - len(slots), 0)
+        slots.sort()
+        estimates = {}
+        for position, job in enumerate(fair_order(queued, self.last_served(self.connection()))):
+            start = slots.pop(0) if slots else 0.0
+            estimates[job['id']] = {'position': position + 1, 'eta_seconds': round(start)}
+            slots.append(start + durations.get(job['kind'], JOB_DEFAULT_DURATION))
+            slots.sort()
+        return {'running': len(running), 'depth': len(queued), 'slots': max_running, 'estimates': estimates}
+
+job_registry = JobRegistry()
+
+# Бюджет запросов текущей задачи (передается в потоки задачи вместе с контекстом)
+current_job_budget = contextvars.ContextVar('current_job_budget', default=None)
+
+class JobBudget:
+    """Счетчик запросов задачи к внешним API с верхней границей (0 — без ограничения)"""
+    def __init__(self, limit):
+        self.limit = limit
+        self.spent = 0
+        self.lock = threading.Lock()
+    
+    def spend(self):
+        """Учитывает один запрос; False, если бюджет уже исчерпан"""
+        with self.lock:
+            if self.limit and self.spent >= self.limit:
+                return False
+            self.spent += 1
+            return True
+    
+    @property
+    def exhausted(self):
+        return bool(self.limit) and self.spent >= self.limit
+
+def spend_upstream_request():
+    """Списывает запрос к внешнему API с бюджета текущей задачи (вне задачи всегда разрешено)"""
+    budget = current_job_budget.get()
+    return budget is None or budget.spend()
+
+class JobScheduler:
+    """Запускает задачи из общей очереди реестра в потоках текущего процесса.
+    
+    Каждый воркер опрашивает очередь раз в JOB_DISPATCH_INTERVAL и сразу после
+    постановки или завершения задачи; забирать задачу может любой воркер, а общий
+    лимит JOB_MAX_RUNNING соблюдается транзакцией claim_next. Для каждой задачи
+    действует свой бюджет запросов к внешним API.
+    """
+    def __init__(self, registry, runners, max_running=JOB_MAX_RUNNING, interval=JOB_DISPATCH_INTERVAL):
+        self.registry = registry
+        self.runners = runners
+        self.max_running = max_running
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pid = None
+    
+    def ensure_started(self):
+        """Запускает поток опроса очереди в текущем процессе (после fork — заново)"""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self.loop, daemon=True).start()
+    
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.dispatch()
+    
+    def dispatch(self):
+        """Запускает задачи из очереди, пока есть свободные места"""
+        try:
+            while True:
+                job = self.registry.claim_next(self.max_running)
+                if job is None:
+                    return
+                threading.Thread(target=self.run, args=(job,)).start()
+        except Exception as e:
+            storage_logger.error("❌ Ошибка планировщика задач: %s", e)
+    
+    def run(self, job):
+        current_job.set(job['id'])
+        budget = JobBudget(job['budget'])
+        current_job_budget.set(budget)
+        cancelled = self.registry.cancel_token(job['id'])
+        stop_flag = lambda: cancelled() or budget.exhausted
+        try:
+            state, error = self.runners[job['kind']](job, stop_flag)
+        except Exception as e:
+            state, error = 'failed', str(e)
+            storage_logger.error("❌ Исключение в задаче %s: %s", job['id'], e)
+        if budget.exhausted and state != 'failed':
+            state, error = 'stopped', 'Исчерпан бюджет запросов к API'
+            storage_logger.warning("⚠️ Задача %s остановлена: исчерпан бюджет %s запросов", job['id'], budget.limit)
+        try:
+            self.registry.update(job['id'], state=state, error=error, spent=budget.spent)
+        except sqlite3.Error as e:
+            storage_logger.error("❌ Ошибка завершения задачи %s: %s", job['id'], e)
+        self.dispatch()
+
 class YandexSearchAPI:
     def __init__(self):
         # ПРИМЕЧАНИЕ: Файл .env существует в проекте и содержит актуальные ключи API
         self.api_key = os.getenv('YANDEX_SEARCH__API_KEY')
         self.base_url = 'https://search-maps.yandex.ru/v1/'
+        self.rate_limiter = SharedTokenBucket('yandex_search', self.api_key, SEARCH_RATE_LIMIT, SEARCH_RATE_BURST)
     
     def radius_to_spn(self, radius_km, latitude):
         """Преобразует радиус в километрах в параметр spn для Яндекс API"""
@@ -85,221 +1963,419 @@ class YandexSearchAPI:
         lon_spn = radius_km / (111.0 * abs(math.cos(math.radians(latitude))))
         
         return f"{lon_spn:.6f},{lat_spn:.6f}"
+    
+    def cached_get(self, endpoint, url, params, stop_flag=None):
+        """GET-запрос к API Яндекса через кэш ответов.
+        
+        Успешный ответ возвращается как CachedResponse, ошибочный — как есть.
+        Возвращает None, если процесс остановлен или бюджет запросов задачи исчерпан до отправки запроса.
+        """
+        data = response_cache.get(endpoint, params)
+        if data is not None:
+            return CachedResponse(data, from_cache=True)
+        
+        if not spend_upstream_request():
+            search_logger.warning("⚠️ Исчерпан бюджет запросов задачи к Яндекс API")
+            return None
+        if not self.rate_limiter.acquire(stop_flag):
+            return None
+        
+        response = http_transport.get(url, params=params, stop_flag=stop_flag)
+        if response.status_code in (403, 429):
+            # Лимит ключа исчерпан — замедляем все воркеры, использующие этот ключ
+            self.rate_limiter.penalize()
+            return response
+        if response.status_code != 200:
+            return response
+        
+        self.rate_limiter.reward()
+        data = response.json()
+        response_cache.put(endpoint, params, data)
+        return CachedResponse(data)
+    
+    def build_search_params(self, org_type, city=None, coordinates=None, radius=5, tile=None):
+        """Формирует параметры запроса к Search API для одного типа организаций.
+        
+        Если передан тайл (SearchTile), запрос ограничивается его квадратом (rspn=1).
+        """
+        params = {
+            'type': 'biz',
+            'lang': 'ru_RU',
+            'apikey': self.api_key,
+            'results': SEARCH_PAGE_SIZE
+        }
+        
+        if coordinates is not None and len(coordinates) == 2:
+            # Поиск по координатам и радиусу
+            lon, lat = coordinates
+            params['text'] = org_type
+            if tile is not None:
+                tile_lon, tile_lat = tile_center(tile, lon, lat)
+                params['ll'] = f"{tile_lon:.6f},{tile_lat:.6f}"
+                params['spn'] = self.radius_to_spn(tile.half_km * 2, tile_lat)
+                params['rspn'] = 1  # Искать только внутри области
+            else:
+                params['ll'] = f"{lon},{lat}"  # Центр поиска
+                params['spn'] = self.radius_to_spn(radius, lat)  # Размер области поиска
+        else:
+            # Поиск по названию города (старый алгоритм)
+            params['text'] = f"{org_type} {city}"
+        
+        return params
+    
+    def fetch_features(self, params, org_type, stop_flag=None):
+        """Выполняет один запрос к Search API с учетом ограничения частоты.
+        
+        Возвращает список объектов (features) или None, если запрос не удался
+        или процесс был остановлен во время ожидания.
+        """
+        try:
+            search_logger.debug("Отправляем запрос к API: '%s'", params['text'])
+            response = self.cached_get('search', self.base_url, params, stop_flag)
+            if response is None:
+                search_logger.info("Процесс остановлен до запроса типа: %s", org_type)
+                return None
+            search_logger.debug("Получен ответ для типа '%s': статус %s%s", org_type, response.status_code, ' (из кэша)' if getattr(response, 'from_cache', False) else '')
+            
+            if response.status_code == 403:
+                search_logger.warning("❌ Превышен лимит запросов для типа '%s'", org_type)
+                return None
+            
+            if response.status_code != 200:
+                search_logger.error("❌ Ошибка API: %s, ответ сервера: %s...", response.status_code, response.text[:200])
+                return None
+            
+            features = response.json().get('features', [])
+            search_logger.debug("📊 API вернул %s объектов для типа '%s'", len(features), org_type)
+            return features
+        except Exception as e:
+            search_logger.error("❌ Исключение при поиске %s: %s", org_type, e)
+            return None
+    
+    def fetch_features_paged(self, params, org_type, stop_flag=None, max_results=None, seen_keys=None, seen_lock=None):
+        """Постранично выбирает объекты через параметр skip.
+        
+        Останавливается, когда страницы закончились, достигнут лимит max_results
+        или очередная страница не принесла ни одного нового объекта
+        (seen_keys — общий для всех типов набор уже полученных ключей).
+        Возвращает (объекты, полностью ли получены): при ошибке на любой странице
+        второе значение False, а объекты — полученные до нее.
+        """
+        if max_results is None:
+            max_results = SEARCH_MAX_RESULTS_PER_TYPE
+        if seen_keys is None:
+            seen_keys = set()
+        if seen_lock is None:
+            seen_lock = threading.Lock()
+        
+        page_size = params.get('results', SEARCH_PAGE_SIZE)
+        features = []
+        complete = True
+        skip = 0
+        
+        while skip < max(max_results, 1):
+            page_params = dict(params, results=min(page_size, max(max_results - skip, 1)))
+            if skip:
+                page_params['skip'] = skip
+            
+            page = self.fetch_features(page_params, org_type, stop_flag)
+            if page is None:
+                complete = False
+                break
+            
+            features += page
+            
+            with seen_lock:
+                new_keys = {self.feature_key(feature) for feature in page} - seen_keys
+                seen_keys.update(new_keys)
+            
+            if len(page) < page_params['results']:
+                break
+            if not new_keys:
+                search_logger.debug("📄 Страница со смещением %s для типа '%s' не принесла новых объектов", skip, org_type)
+                break
+            
+            skip += len(page)
+        
+        return features, complete
+    
+    @staticmethod
+    def feature_key(feature):
+        """Ключ объекта Search API: ID организации или название с координатами"""
+        properties = feature.get('properties', {})
+        yandex_id = properties.get('CompanyMetaData', {}).get('id')
+        if yandex_id:
+            return yandex_id
+        return (properties.get('name', ''), tuple(feature.get('geometry', {}).get('coordinates', [])))
+    
+    def feature_to_organization(self, feature, org_type, city, index):
+        """Преобразует объект ответа Search API в запись Organization"""
+        properties = feature.get('properties', {})
+        geometry = feature.get('geometry', {})
+        
+        org_name = properties.get('name', '')
+        org_description = properties.get('description', '')
+        
+        # Извлекаем данные из CompanyMetaData
+        company_meta = properties.get('CompanyMetaData', {})
+        yandex_id = company_meta.get('id', '')
+        full_address = company_meta.get('address', org_description)
+        website = company_meta.get('url', '')
+        
+        return Organization(
+            name=org_name,
+            coordinates=geometry.get('coordinates', []),
+            yandex_id=yandex_id or f"yandex_{index:04d}_{org_type.replace(' ', '_')}",
+            full_address=full_address or org_description,
+            website=website or placeholder_website(org_name),
+            email='',         # Будет заполнен LLM
+            type=org_type,
+            city=city
+        )
+    
+    def search_organizations(self, city=None, selected_types=None, stop_flag=None, coordinates=None, radius=5, max_per_type=None,
+                             dedup_index=None, on_progress=None, on_event=None, results=None, results_lock=None):
+        """Поиск курортных организаций в заданном городе или по координатам.
+        
+        Запросы выполняются параллельно пулом из SEARCH_MAX_WORKERS потоков
+        с общим для всех воркеров ограничением частоты SEARCH_RATE_LIMIT запросов в секунду.
+        Для каждого запроса выбирается до max_per_type результатов постранично
+        (по умолчанию SEARCH_MAX_RESULTS_PER_TYPE).
+        
+        При поиске по координатам круг покрывается квадродеревом тайлов:
+        тайл, ответ по которому заполнен до лимита, делится на четыре части,
+        пока не перестанет заполняться или не достигнет SEARCH_MIN_TILE_KM.
+        Организации за пределами радиуса отбрасываются. Части круга, которые
+        уже были полностью просмотрены не раньше SEARCH_COVERAGE_TTL назад,
+        не запрашиваются: организации из них берутся из хранилища. Полностью
+        просмотренные круги возвращаются в 'coverage' для save_search; время
+        просмотра круга — самое раннее из повторно использованных частей.
+        
+        Результаты объединяются в порядке выбранных типов по мере готовности
+        всех запросов очередного типа; дубликаты отсекаются индексом
+        OrganizationIndex (можно передать общий индекс через dedup_index).
+        После каждого типа вызывается on_progress(обработано типов, найдено организаций).
+        on_event(событие, данные) получает события 'tile' по каждому тайлу и
+        'organizations' с организациями очередного типа и их позициями в результатах.
+        
+        Несколько областей одного пакетного поиска выполняются одновременно с общими
+        dedup_index и списком results; добавление в него защищается results_lock.
         
-    
-    def search_organizations(self, city=None, selected_types=None, stop_flag=None, coordinates=None, radius=5):
-        """Поиск курортных организаций в заданном городе или по координатам"""
-        print(f"🔑 API ключ загружен: {'Да' if self.api_key else 'Нет'}")
-        print(f"🔑 Выбранные типы: {selected_types}")
+        Кроме результатов возвращаются отброшенные как дубликаты организации ('duplicates'):
+        хранилище запоминает, что они найдены и под своим типом.
+        """
+        search_logger.debug("🔑 API ключ загружен: %s", 'Да' if self.api_key else 'Нет')
+        search_logger.debug("🔑 Выбранные типы: %s", selected_types)
         
         # Определяем режим поиска
         search_by_coordinates = coordinates is not None and len(coordinates) == 2
         if search_by_coordinates:
             lon, lat = coordinates
-            print(f"🎯 Режим поиска: по координатам {lat:.6f}, {lon:.6f}, радиус {radius} км")
+            search_logger.info("🎯 Режим поиска: по координатам %.6f, %.6f, радиус %s км", lat, lon, radius)
         else:
-            print(f"🏙️ Режим поиска: по названию города '{city}'")
+            search_logger.info("🏙️ Режим поиска: по названию города '%s'", city)
         
         if not self.api_key:
-            print("❌ API ключ не найден")
+            search_logger.warning("❌ API ключ не найден")
             return {'error': 'API ключ не найден'}
         
-        if search_by_coordinates:
-            print(f"Поиск организаций по координатам: {lat:.6f}, {lon:.6f}, радиус {radius} км")
-        else:
-            print(f"Поиск организаций в городе: {city}")
-        
         # Используем только выбранные типы организаций
-        organization_types = selected_types
+        organization_types = selected_types or []
+        is_stopped = lambda: bool(stop_flag and stop_flag())
+        if max_per_type is None:
+            max_per_type = SEARCH_MAX_RESULTS_PER_TYPE
         
-        results = []
+        if results is None:
+            results = []
+        duplicates = []
+        coverage = []
+        started = time.time()
+        # Время самого раннего просмотра частей круга, взятых из хранилища, по типам
+        reused_since = {}
+        merge_lock = results_lock or threading.Lock()
+        if not organization_types:
+            return {'organizations': results, 'duplicates': duplicates, 'coverage': coverage}
         
-        for i, org_type in enumerate(organization_types):
-            print(f"[{i+1}/{len(organization_types)}] Обрабатываем тип: {org_type}")
-            
-            if stop_flag and stop_flag():
-                print(f"Процесс остановлен на типе: {org_type}")
-                break
-            
-            # Добавляем небольшую задержку для демонстрации работы кнопки СТОП
-            import time
-            time.sleep(1)
-                
-            if search_by_coordinates:
-                # Поиск по координатам и радиусу
-                query = org_type
-                print(f"Формируем запрос по координатам: '{query}'")
-                print(f"🔍 Тип организации: '{org_type}'")
-                print(f"🔍 Координаты: {lat:.6f}, {lon:.6f}")
-                print(f"🔍 Радиус: {radius} км")
-                
-                # Преобразуем радиус в параметр spn для Яндекс API
-                spn = self.radius_to_spn(radius, lat)
-                print(f"🔍 SPN параметр: {spn}")
-                
-                params = {
-                    'text': query,
-                    'type': 'biz',
-                    'lang': 'ru_RU',
-                    'apikey': self.api_key,
-                    'll': f"{lon},{lat}",  # Центр поиска
-                    'spn': spn,  # Размер области поиска
-                    'results': 20
-                }
+        # Общий набор ключей для досрочной остановки постраничной выборки в режиме города;
+        # у каждого тайла свой набор, иначе дочерние тайлы остановятся на объектах родителя
+        seen_keys = set()
+        seen_lock = threading.Lock()
+        features_by_type = {org_type: [] for org_type in organization_types}
+        stored_by_type = {org_type: [] for org_type in organization_types}
+        tiles_by_type = {org_type: 0 for org_type in organization_types}
+        # Типы, результаты которых обрезаны лимитами или ошибками: их круг не считается просмотренным
+        incomplete_types = set()
+        outstanding_by_type = {org_type: 0 for org_type in organization_types}
+        merged_types = 0
+        if dedup_index is None:
+            dedup_index = OrganizationIndex()
+        
+        def merge_ready_types():
+            """Добавляет в результаты типы, все запросы которых завершены, сохраняя порядок типов"""
+            nonlocal merged_types
+            while merged_types < len(organization_types) and not outstanding_by_type[organization_types[merged_types]]:
+                org_type = organization_types[merged_types]
+                merged_types += 1
+                with merge_lock:
+                    merged_before = len(results)
+                    self.merge_stored(results, stored_by_type.pop(org_type), org_type, dedup_index)
+                    self.merge_features(results, features_by_type.pop(org_type), org_type, city, dedup_index,
+                                        (lon, lat, radius) if search_by_coordinates else None, duplicates)
+                    if on_event:
+                        on_event('organizations', {
+                            'type': org_type,
+                            'organizations': [dict(org.to_dict(), position=position)
+                                              for position, org in enumerate(results[merged_before:], merged_before)],
+                        })
+                if search_by_coordinates:
+                    search_logger.info("[%s/%s] Тип '%s': запрошено тайлов %s", merged_types, len(organization_types), org_type, tiles_by_type[org_type])
+                if on_progress:
+                    on_progress(merged_types, len(results))
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, SEARCH_MAX_WORKERS))
+        pending = {}
+        
+        def submit(org_type, tile=None):
+            params = self.build_search_params(org_type, city, coordinates if search_by_coordinates else None, radius, tile)
+            if tile is None:
+                future = executor.submit(contextvars.copy_context().run, self.fetch_features_paged,
+                                         params, org_type, is_stopped, max_per_type, seen_keys, seen_lock)
             else:
-                # Поиск по названию города (старый алгоритм)
-                query = f"{org_type} {city}"
-                print(f"Формируем запрос: '{query}'")
-                print(f"🔍 Тип организации: '{org_type}'")
-                print(f"🔍 Город: '{city}'")
-                params = {
-                    'text': query,
-                    'type': 'biz',
-                    'lang': 'ru_RU',
-                    'apikey': self.api_key,
-                    'results': 20
-                }
+                tiles_by_type[org_type] += 1
+                future = executor.submit(contextvars.copy_context().run, self.fetch_features_paged,
+                                         params, org_type, is_stopped, max_per_type, set())
+            outstanding_by_type[org_type] += 1
+            pending[future] = (org_type, tile)
+        
+        try:
+            for org_type in organization_types:
+                if search_by_coordinates:
+                    for tile in self.plan_coordinate_search(org_type, lon, lat, radius, stored_by_type, reused_since):
+                        submit(org_type, tile)
+                else:
+                    submit(org_type)
             
-            try:
-                print(f"Отправляем запрос к API: {self.base_url}")
-                response = requests.get(self.base_url, params=params, timeout=10)
-                print(f"Получен ответ: статус {response.status_code}")
-                
-                if response.status_code == 403:
-                    print(f"❌ Превышен лимит запросов для типа '{org_type}'")
-                    continue
+            while pending:
+                # Ждем результаты небольшими интервалами, чтобы кнопка СТОП срабатывала сразу
+                done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    print(f"📊 Структура ответа Yandex API: {list(data.keys())}")
-                    
-                    features = data.get('features', [])
-                    print(f"📊 API вернул {len(features)} объектов для типа '{org_type}'")
-                    
-                    # Показываем структуру первого объекта для анализа
-                    if features:
-                        first_feature = features[0]
-                        print(f"📊 Структура объекта: {list(first_feature.keys())}")
-                        print(f"📊 Properties: {list(first_feature.get('properties', {}).keys())}")
-                        print(f"📊 Geometry: {list(first_feature.get('geometry', {}).keys())}")
-                    
-                    if len(features) == 0:
-                        print(f"Нет организаций типа '{org_type}' в городе '{city}'")
-                        continue
-                    
-                    added_count = 0
-                    for j, feature in enumerate(features):
-                        if stop_flag():
-                            print(f"Процесс остановлен при обработке объекта {j+1} типа {org_type}")
-                            break
-                            
-                        properties = feature.get('properties', {})
-                        geometry = feature.get('geometry', {})
-                        
-                        org_name = properties.get('name', '')
-                        org_description = properties.get('description', '')
-                        
-                        print(f"  [{j+1}/{len(features)}] Организация: '{org_name}'")
-                        print(f"      Адрес: '{org_description}'")
-                        
-                        # Извлекаем данные из CompanyMetaData
-                        company_meta = properties.get('CompanyMetaData', {})
-                        yandex_id = company_meta.get('id', '')
-                        full_address = company_meta.get('address', org_description)
-                        website = company_meta.get('url', '')
-                        
-                        print(f"      ID из CompanyMetaData: {yandex_id}")
-                        print(f"      Адрес из CompanyMetaData: {full_address}")
-                        print(f"      Веб-сайт из CompanyMetaData: {website}")
-                        
-                        org_data = {
-                            'name': org_name,
-                            'coordinates': geometry.get('coordinates', []),
-                            'yandex_id': yandex_id or f"yandex_{len(results)+1:04d}_{org_type.replace(' ', '_')}",
-                            'full_address': full_address or org_description,
-                            'website': website or f"https://{org_name[:15].replace(' ', '').lower()}.ru",
-                            'email': '',         # Будет заполнен LLM
-                            'type': org_type,
-                            'city': city
-                        }
-                        
-                        if org_data['name'] and org_data not in results:
-                            results.append(org_data)
-                            added_count += 1
-                            print(f"      ✅ Добавлена в результаты (ID: {org_data['yandex_id']}, Сайт: {org_data['website']})")
-                        else:
-                            print(f"      ❌ Пропущена (дубликат или пустое название)")
-                    
-                    print(f"Добавлено {added_count} новых организаций типа '{org_type}'")
-                else:
-                    print(f"❌ Ошибка API: {response.status_code}")
-                    print(f"Ответ сервера: {response.text[:200]}...")
+                # Завершенные запросы учитываем и при остановке, чтобы не терять уже полученные данные
+                for future in done:
+                    org_type, tile = pending.pop(future)
+                    features, complete = future.result()
+                    if not complete:
+                        incomplete_types.add(org_type)
+                    features_by_type[org_type].extend(features)
+                    outstanding_by_type[org_type] -= 1
                     
-            except Exception as e:
-                print(f"❌ Исключение при поиске {org_type}: {e}")
-                continue
-            
-            # Добавляем задержку после обработки каждого типа
-            time.sleep(0.5)
+                    if tile is not None:
+                        search_logger.debug("🧩 Тайл %+.2f/%+.2f км (сторона %.2f км) типа '%s': %s объектов", tile.x_km, tile.y_km, tile.half_km * 2, org_type, len(features))
+                        if on_event:
+                            on_event('tile', {'type': org_type, 'x_km': tile.x_km, 'y_km': tile.y_km,
+                                              'half_km': tile.half_km, 'features': len(features),
+                                              'pending': outstanding_by_type[org_type]})
+                        # Ответ заполнен до лимита — в тайле есть еще организации, делим его
+                        if len(features) >= max_per_type:
+                            if tile.half_km >= SEARCH_MIN_TILE_KM and tiles_by_type[org_type] + 4 <= SEARCH_MAX_TILES_PER_TYPE:
+                                for child in split_tile(tile, radius):
+                                    submit(org_type, child)
+                            else:
+                                incomplete_types.add(org_type)
                 
-            print(f"Завершен поиск типа '{org_type}'. Всего найдено: {len(results)}")
-            print("-" * 50)
-        
-        print(f"Всего найдено организаций: {len(results)}")
+                merge_ready_types()
+                if is_stopped():
+                    search_logger.info("Процесс остановлен во время поиска")
+                    break
+        finally:
+            # Отменяем еще не начатые запросы и не ждем выполняющиеся
+            executor.shutdown(wait=False, cancel_futures=True)
         
-        # Фильтруем результаты по выбранным типам (как в тестовых данных)
-        print(f"🔍 До фильтрации: {len(results)} организаций")
-        print(f"🔍 Выбранные типы: {selected_types}")
-        for i, org in enumerate(results[:5]):  # Показываем первые 5
-            print(f"  [{i+1}] {org.get('name', 'Без названия')} - Тип: '{org.get('type', 'Нет')}'")
+        # После остановки добавляем то, что успели получить
+        for org_type in organization_types[merged_types:]:
+            outstanding_by_type[org_type] = 0
+        merge_ready_types()
         
-        filtered_results = [org for org in results if org['type'] in selected_types]
-        print(f"🔍 После фильтрации по типам: {len(filtered_results)} организаций")
+        # Полностью просмотренные круги записываются вместе с организациями, чтобы следующие поиски рядом их не запрашивали
+        if search_by_coordinates and not is_stopped():
+            coverage = [(org_type, lon, lat, radius, reused_since.get(org_type, started))
+                        for org_type in organization_types if org_type not in incomplete_types]
         
-        # Удаляем дубликаты по адресу и сайту
-        deduplicated_results = self.remove_duplicates(filtered_results)
-        print(f"🔍 После удаления дубликатов: {len(deduplicated_results)} организаций")
+        search_logger.info("Всего найдено организаций: %s, отброшено дубликатов: %s", len(results), dedup_index.duplicates)
         
-        return {'organizations': deduplicated_results}
+        return {'organizations': results, 'duplicates': duplicates, 'coverage': coverage}
     
-    def remove_duplicates(self, organizations):
-        """Удаляет дубликаты организаций по адресу и сайту"""
-        seen_addresses = set()
-        seen_websites = set()
-        unique_organizations = []
+    def plan_coordinate_search(self, org_type, lon, lat, radius, stored_by_type, reused_since):
+        """Тайлы, которые нужно запросить для типа; организации из просмотренных частей круга — из хранилища.
+        
+        Если просмотренные части не запрашиваются повторно, в reused_since[тип] записывается
+        время самого раннего из их просмотров.
+        """
+        try:
+            covered = organization_store.find_coverage(org_type, lon, lat, radius)
+            if not covered:
+                return [SearchTile(0.0, 0.0, float(radius))]
+            stored_by_type[org_type] = [
+                org for org in organization_store.organizations_in_circle(org_type, lon, lat, radius)
+                if org.lon is not None and any(distance_km(c_lon, c_lat, org.lon, org.lat) <= c_radius for c_lon, c_lat, c_radius, _ in covered)
+            ]
+        except Exception as e:
+            storage_logger.warning("⚠️ Ошибка чтения просмотренных областей: %s", e)
+            return [SearchTile(0.0, 0.0, float(radius))]
         
+        circles = [to_local_km(c_lon, c_lat, lon, lat) + (c_radius,) for c_lon, c_lat, c_radius, _ in covered]
+        tiles = plan_tiles(radius, circles)
+        # В редкозаселенной области весь круг помещается в несколько страниц одного запроса —
+        # это дешевле, чем отдельные запросы по непросмотренным тайлам
+        known = len(stored_by_type[org_type])
+        if known < SEARCH_MAX_RESULTS_PER_TYPE and len(tiles) > math.ceil((known + 1) / SEARCH_PAGE_SIZE):
+            tiles = [SearchTile(0.0, 0.0, float(radius))]
+        else:
+            reused_since[org_type] = min(created for _, _, _, created in covered)
+        search_logger.info("♻️ Тип '%s': из хранилища %s организаций, к API %s тайлов",
+                           org_type, len(stored_by_type[org_type]), len(tiles))
+        return tiles
+    
+    @staticmethod
+    def merge_stored(results, organizations, org_type, dedup_index):
+        """Добавляет в результаты организации из хранилища, пропуская дубликаты"""
+        org_type = intern_string(org_type)
         for org in organizations:
-            # Получаем адрес и сайт
-            address = org.get('full_address', '').strip().lower()
-            website = org.get('website', '').strip().lower()
-            
-            # Создаем ключ для проверки дубликатов
-            address_key = address if address else f"no_address_{org.get('yandex_id', '')}"
-            website_key = website if website else f"no_website_{org.get('yandex_id', '')}"
-            
-            # Проверяем, не встречались ли уже такие адрес или сайт
-            is_duplicate = False
-            
-            if address and address in seen_addresses:
-                print(f"🔄 Найден дубликат по адресу: {org.get('name', 'Без названия')} - {address}")
-                is_duplicate = True
+            org.type = org_type
+            if dedup_index.add(org):
+                results.append(org)
+    
+    def merge_features(self, results, features, org_type, city, dedup_index, circle=None, duplicates=None):
+        """Добавляет объекты одного типа в результаты, пропуская дубликаты и объекты вне круга.
+        
+        Отброшенные дубликаты добавляются в список duplicates, если он передан.
+        """
+        if not features:
+            search_logger.info("Нет организаций типа '%s' в городе '%s'", org_type, city)
+            return 0
+        
+        added_count = 0
+        debug_enabled = search_logger.isEnabledFor(logging.DEBUG)
+        for j, feature in enumerate(features):
+            org_data = self.feature_to_organization(feature, org_type, city, len(results) + 1)
             
-            if website and website in seen_websites:
-                print(f"🔄 Найден дубликат по сайту: {org.get('name', 'Без названия')} - {website}")
-                is_duplicate = True
+            if circle and org_data.lon is not None and distance_km(circle[0], circle[1], org_data.lon, org_data.lat) > circle[2]:
+                continue
             
-            if not is_duplicate:
-                unique_organizations.append(org)
-                seen_addresses.add(address_key)
-                seen_websites.add(website_key)
-            else:
-                print(f"❌ Удален дубликат: {org.get('name', 'Без названия')}")
-        
-        removed_count = len(organizations) - len(unique_organizations)
-        if removed_count > 0:
-            print(f"🧹 Удалено дубликатов: {removed_count}")
+            if not org_data.name:
+                continue
+            if not dedup_index.add(org_data):
+                if duplicates is not None:
+                    duplicates.append(org_data)
+                continue
+            results.append(org_data)
+            added_count += 1
+            # Подробности выводим выборочно, чтобы не засорять лог на больших выборках
+            if debug_enabled and j % LOG_FEATURE_SAMPLE == 0:
+                search_logger.debug("  [%s/%s] '%s' (ID: %s, адрес: %s, сайт: %s)", j + 1, len(features),
+                                    org_data.name, org_data.yandex_id, org_data.full_address, org_data.website)
         
-        return unique_organizations
+        search_logger.info("Добавлено %s новых организаций типа '%s'. Всего найдено: %s", added_count, org_type, len(results))
+        return added_count
     
     def get_organization_details_by_coordinates(self, lon, lat, stop_flag):
         """Получение детальной информации об организации по координатам"""
@@ -317,8 +2393,10 @@ class YandexSearchAPI:
         }
         
         try:
-            print(f"      🔍 Запрашиваем детали по координатам: {lat}, {lon}")
-            response = requests.get("https://geocode-maps.yandex.ru/1.x/", params=params, timeout=10)
+            search_logger.debug("      🔍 Запрашиваем детали по координатам: %s, %s", lat, lon)
+            response = self.cached_get('geocode', "https://geocode-maps.yandex.ru/1.x/", params, stop_flag)
+            if response is None:
+                return {'error': 'Процесс остановлен'}
             
             if response.status_code == 200:
                 data = response.json()
@@ -332,7 +2410,7 @@ class YandexSearchAPI:
                     yandex_id = properties.get('id', '')
                     full_address = properties.get('text', '')
                     
-                    print(f"      📍 Найдена информация: ID={yandex_id[:20]}..., Адрес={full_address[:50]}...")
+                    search_logger.debug("      📍 Найдена информация: ID=%s..., Адрес=%s...", yandex_id[:20], full_address[:50])
                     
                     return {
                         'yandex_id': yandex_id,
@@ -342,14 +2420,14 @@ class YandexSearchAPI:
                         'hours': ''
                     }
                 else:
-                    print(f"      ❌ Нет данных по координатам")
+                    search_logger.warning("      ❌ Нет данных по координатам")
                     return {'error': 'Нет данных по координатам'}
             else:
-                print(f"      ❌ Ошибка геокодинга: {response.status_code}")
+                search_logger.error("      ❌ Ошибка геокодинга: %s", response.status_code)
                 return {'error': f'Ошибка геокодинга: {response.status_code}'}
                 
         except Exception as e:
-            print(f"      ❌ Исключение при геокодинге: {e}")
+            search_logger.error("      ❌ Исключение при геокодинге: %s", e)
             return {'error': f'Ошибка запроса: {e}'}
 
     def search_website_by_name(self, org_name, city, stop_flag):
@@ -367,8 +2445,10 @@ class YandexSearchAPI:
         }
         
         try:
-            print(f"      🌐 Ищем веб-сайт для: {org_name}")
-            response = requests.get(self.base_url, params=params, timeout=10)
+            search_logger.debug("      🌐 Ищем веб-сайт для: %s", org_name)
+            response = self.cached_get('search', self.base_url, params, stop_flag)
+            if response is None:
+                return {'error': 'Процесс остановлен'}
             
             if response.status_code == 200:
                 data = response.json()
@@ -385,20 +2465,20 @@ class YandexSearchAPI:
                              properties.get('web', ''))
                     
                     if website:
-                        print(f"      🌐 Найден веб-сайт: {website}")
+                        search_logger.debug("      🌐 Найден веб-сайт: %s", website)
                         return {'website': website}
                     else:
-                        print(f"      ❌ Веб-сайт не найден")
+                        search_logger.warning("      ❌ Веб-сайт не найден")
                         return {'error': 'Веб-сайт не найден'}
                 else:
-                    print(f"      ❌ Организация не найдена для поиска веб-сайта")
+                    search_logger.warning("      ❌ Организация не найдена для поиска веб-сайта")
                     return {'error': 'Организация не найдена'}
             else:
-                print(f"      ❌ Ошибка поиска веб-сайта: {response.status_code}")
+                search_logger.error("      ❌ Ошибка поиска веб-сайта: %s", response.status_code)
                 return {'error': f'Ошибка поиска: {response.status_code}'}
                 
         except Exception as e:
-            print(f"      ❌ Исключение при поиске веб-сайта: {e}")
+            search_logger.error("      ❌ Исключение при поиске веб-сайта: %s", e)
             return {'error': f'Ошибка запроса: {e}'}
 
     def get_organization_details(self, yandex_id, stop_flag):
@@ -413,7 +2493,9 @@ class YandexSearchAPI:
         }
         
         try:
-            response = requests.get(f"{self.base_url}details", params=params, timeout=10)
+            response = self.cached_get('details', f"{self.base_url}details", params, stop_flag)
+            if response is None:
+                return {'error': 'Процесс остановлен'}
             if response.status_code == 200:
                 data = response.json()
                 properties = data.get('properties', {})
@@ -438,56 +2520,448 @@ class YandexSearchAPI:
         except Exception as e:
             return {'error': f'Ошибка запроса: {e}'}
 
+# Пакетный поиск email через LLM: организаций в одном запросе и число попыток для пропущенных
+LLM_EMAIL_BATCH_SIZE = int(os.getenv('LLM_EMAIL_BATCH_SIZE', 10))
+LLM_EMAIL_MAX_ATTEMPTS = int(os.getenv('LLM_EMAIL_MAX_ATTEMPTS', 2))
+# Параллельный поиск email: запросов к LLM одновременно и бюджет запросов в минуту (общий для воркеров)
+LLM_EMAIL_CONCURRENCY = int(os.getenv('LLM_EMAIL_CONCURRENCY', 4))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv('LLM_REQUESTS_PER_MINUTE', 60))
+# Кэш найденных email: файл и время жизни найденных адресов и ответов «не найден» (секунды)
+EMAIL_CACHE_PATH = os.getenv('EMAIL_CACHE_PATH', os.path.join('exports', 'email_cache.sqlite3'))
+EMAIL_CACHE_TTL_FOUND = int(os.getenv('EMAIL_CACHE_TTL_FOUND', 180 * 24 * 3600))
+EMAIL_CACHE_TTL_NOT_FOUND = int(os.getenv('EMAIL_CACHE_TTL_NOT_FOUND', 14 * 24 * 3600))
+
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)*\.[a-zа-я]{2,}', re.IGNORECASE)
+EMAIL_NOT_FOUND = 'не найден'
+
+def extract_email(text):
+    """Возвращает первый email из текста ответа или None"""
+    match = EMAIL_PATTERN.search(text or '')
+    return match.group(0).strip('.').lower() if match else None
+
+def parse_json_object(text):
+    """Достает JSON-объект из ответа модели (в том числе обернутый в ```json ... ```)"""
+    text = (text or '').strip()
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        value = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
 class ProxyAPIClient:
     def __init__(self):
         self.api_key = os.getenv('PROXYAPI_KEY')
         self.base_url = os.getenv('PROXYAPI_BASE_URL')
+        self.rate_limiter = SharedTokenBucket('llm', self.api_key, LLM_REQUESTS_PER_MINUTE / 60.0,
+                                              burst=max(1, LLM_EMAIL_CONCURRENCY))
     
-    def search_email(self, organization_name, city, stop_flag):
-        """Поиск email организации через LLM"""
-        if not self.api_key or not self.base_url:
-            return {'error': 'ProxyAPI credentials не найдены'}
+    def chat_completion(self, prompt, max_tokens, stop_flag=None):
+        """Запрос к chat completions. Возвращает (текст ответа, None) или (None, ошибка)"""
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
         
-        prompt = f"""
-        Найди официальный email адрес для организации "{organization_name}" в городе {city}.
-        Организация предоставляет услуги размещения отдыхающих (база отдыха, дом отдыха, гостиница, санаторий, гостевой дом, хостел).
+        data = {
+            'model': 'gpt-3.5-turbo',
+            'messages': [
+                {'role': 'user', 'content': prompt}
+            ],
+            'max_tokens': max_tokens
+        }
         
-        Верни только email адрес, если найдешь. Если не найдешь, верни "не найден".
-        """
+        if not spend_upstream_request():
+            return None, 'Исчерпан бюджет запросов задачи'
+        if not self.rate_limiter.acquire(stop_flag):
+            return None, 'Процесс остановлен'
         
         try:
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
-            
-            data = {
-                'model': 'gpt-3.5-turbo',
-                'messages': [
-                    {'role': 'user', 'content': prompt}
-                ],
-                'max_tokens': 100
-            }
-            
-            response = requests.post(
+            response = http_transport.post(
                 f"{self.base_url}/v1/chat/completions",
                 headers=headers,
                 json=data,
-                timeout=30
+                read_timeout=30,
+                stop_flag=stop_flag
             )
             
-            if response.status_code == 200:
-                result = response.json()
-                email = result.get('choices', [{}])[0].get('message', {}).get('content', '').strip()
-                if '@' in email and email != 'не найден':
-                    return {'email': email}
-                else:
-                    return {'email': 'не найден'}
-            else:
-                return {'error': f'Ошибка API: {response.status_code}'}
+            if response.status_code == 429:
+                self.rate_limiter.penalize()
+            if response.status_code != 200:
+                return None, f'Ошибка API: {response.status_code}'
+            self.rate_limiter.reward()
+            
+            result = response.json()
+            return result.get('choices', [{}])[0].get('message', {}).get('content', '').strip(), None
+        except Exception as e:
+            return None, f'Ошибка запроса: {e}'
+    
+    def search_emails_batch(self, organizations, stop_flag=None):
+        """Пакетный поиск email: несколько организаций в одном запросе к LLM.
+        
+        organizations — словарь {ключ: организация}. Модель отвечает JSON-объектом
+        {номер: email или "не найден"}; записи, которых нет в ответе или которые
+        не удалось разобрать, запрашиваются повторно меньшими пакетами
+        (до LLM_EMAIL_MAX_ATTEMPTS попыток). Возвращает {ключ: {'email': ...}}
+        для разобранных записей и {ключ: {'error': ...}} для остальных.
+        """
+        if not self.api_key or not self.base_url:
+            return {key: {'error': 'ProxyAPI credentials не найдены'} for key in organizations}
+        
+        results = {}
+        pending = list(organizations.keys())
+        batch_size = max(1, LLM_EMAIL_BATCH_SIZE)
+        
+        for attempt in range(max(1, LLM_EMAIL_MAX_ATTEMPTS)):
+            if not pending or (stop_flag and stop_flag()):
+                break
+            
+            missing = []
+            for start in range(0, len(pending), batch_size):
+                if stop_flag and stop_flag():
+                    missing.extend(pending[start:])
+                    break
                 
+                batch = pending[start:start + batch_size]
+                parsed, error = self.request_email_batch([organizations[key] for key in batch], stop_flag)
+                for number, key in enumerate(batch, 1):
+                    if str(number) in parsed:
+                        results[key] = {'email': parsed[str(number)]}
+                    else:
+                        results[key] = {'error': error or 'Нет ответа для организации'}
+                        missing.append(key)
+            
+            if missing:
+                email_logger.info("✉️ Попытка %s: без ответа осталось %s из %s организаций", attempt + 1, len(missing), len(pending))
+            pending = missing
+            # Повторяем пропущенные записи пакетами поменьше
+            batch_size = max(1, batch_size // 2)
+        
+        return results
+    
+    def request_email_batch(self, organizations, stop_flag=None):
+        """Один запрос к LLM для пакета организаций. Возвращает ({номер: email}, ошибка)"""
+        lines = []
+        for number, org in enumerate(organizations, 1):
+            details = [f'название: "{org.name}"', f'город: {org.city or "не указан"}']
+            if org.known_website:
+                details.append(f"сайт: {org.known_website}")
+            if org.full_address:
+                details.append(f"адрес: {org.full_address}")
+            lines.append(f"{number}. " + '; '.join(details))
+        
+        prompt = f"""
+        Найди официальные email адреса для организаций из списка. Организации предоставляют услуги размещения
+        отдыхающих (база отдыха, дом отдыха, гостиница, санаторий, гостевой дом, хостел).
+        
+        {chr(10).join(lines)}
+        
+        Ответь только JSON-объектом, где ключ — номер организации из списка, а значение — email адрес
+        или "не найден", например: {{"1": "info@example.ru", "2": "не найден"}}
+        """
+        
+        content, error = self.chat_completion(prompt, 40 * len(organizations) + 50, stop_flag)
+        if error:
+            return {}, error
+        
+        answer = parse_json_object(content)
+        if answer is None:
+            email_logger.warning("⚠️ Не удалось разобрать JSON ответа LLM: %s...", content[:200])
+            return {}, 'Некорректный ответ LLM'
+        
+        parsed = {}
+        for number, value in answer.items():
+            number = str(number).strip().rstrip('.')
+            if not number.isdigit() or not 1 <= int(number) <= len(organizations):
+                continue
+            if isinstance(value, str) and value.strip().lower() == EMAIL_NOT_FOUND:
+                parsed[number] = EMAIL_NOT_FOUND
+            elif isinstance(value, str) and extract_email(value):
+                parsed[number] = extract_email(value)
+        return parsed, None
+
+class EmailCache(SQLiteStore):
+    """Постоянный кэш email организаций, включая ответы «не найден» (с меньшим TTL).
+    
+    Ключ — Yandex ID, а для сгенерированных ID — нормализованные название, город,
+    адрес (или округленные координаты) и настоящий сайт, поэтому одна и та же
+    организация из пересекающихся поисков запрашивается у LLM один раз,
+    а одноименные организации в разных местах не делят ответ.
+    """
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS emails (
+            key TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            found INTEGER NOT NULL,
+            updated REAL NOT NULL
+        )''',
+    ]
+    
+    def __init__(self, path=EMAIL_CACHE_PATH, ttl_found=EMAIL_CACHE_TTL_FOUND, ttl_not_found=EMAIL_CACHE_TTL_NOT_FOUND):
+        super().__init__(path)
+        self.ttl_found = ttl_found
+        self.ttl_not_found = ttl_not_found
+    
+    @staticmethod
+    def make_key(org):
+        yandex_id = org.yandex_id
+        if yandex_id and not yandex_id.startswith('yandex_'):
+            return f"id:{yandex_id}"
+        location = normalize_address(org.full_address)
+        if not location and org.lon is not None:
+            location = f"{org.lat:.4f},{org.lon:.4f}"
+        return '|'.join([
+            normalize_name(org.name),
+            normalize_name(org.city or ''),
+            location,
+            normalize_website(org.known_website),
+        ])
+    
+    def get_many(self, organizations):
+        """Пакетная проверка: возвращает {ключ организации: email} для свежих записей кэша"""
+        keys = {key: self.make_key(org) for key, org in organizations.items()}
+        found = {}
+        try:
+            conn = self.connection()
+            cache_keys = list(set(keys.values()))
+            now = time.time()
+            # Ограничение SQLite на число параметров в запросе
+            for start in range(0, len(cache_keys), 500):
+                chunk = cache_keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, email, found, updated FROM emails WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for cache_key, email, is_found, updated in rows:
+                    ttl = self.ttl_found if is_found else self.ttl_not_found
+                    if now - updated <= ttl:
+                        found[cache_key] = email
         except Exception as e:
-            return {'error': f'Ошибка запроса: {e}'}
+            email_logger.warning("⚠️ Ошибка чтения кэша email: %s", e)
+        
+        result = {}
+        for key, cache_key in keys.items():
+            if cache_key in found:
+                result[key] = found[cache_key]
+                self.count('emails', 'hits')
+            else:
+                self.count('emails', 'misses')
+        return result
+    
+    def put(self, org, email):
+        """Сохраняет найденный email или ответ «не найден»"""
+        try:
+            conn = self.connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO emails (key, email, found, updated) VALUES (?, ?, ?, ?)',
+                (self.make_key(org), email, int(email != EMAIL_NOT_FOUND), time.time())
+            )
+            conn.commit()
+        except Exception as e:
+            email_logger.warning("⚠️ Ошибка записи в кэш email: %s", e)
+
+email_cache = EmailCache()
+
+# Поиск email на сайтах организаций: страницы, лимиты и вежливость по отношению к хостам
+CRAWLER_PATHS = ['/', '/contacts', '/contact', '/kontakty', '/about']
+CRAWLER_WORKERS = int(os.getenv('CRAWLER_WORKERS', 8))
+CRAWLER_PER_HOST_CONCURRENCY = int(os.getenv('CRAWLER_PER_HOST_CONCURRENCY', 2))
+CRAWLER_HOST_DELAY = float(os.getenv('CRAWLER_HOST_DELAY', 0.5))
+CRAWLER_MAX_BYTES = int(os.getenv('CRAWLER_MAX_BYTES', 512 * 1024))
+CRAWLER_CONNECT_TIMEOUT = float(os.getenv('CRAWLER_CONNECT_TIMEOUT', 3))
+CRAWLER_READ_TIMEOUT = float(os.getenv('CRAWLER_READ_TIMEOUT', 5))
+
+MAILTO_PATTERN = re.compile(r'mailto:([^"\'?>\s]+)', re.IGNORECASE)
+# Адреса, похожие на email, которые на самом деле имена файлов или служебные адреса
+EMAIL_JUNK_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.js', '.css')
+EMAIL_JUNK_DOMAINS = ('example.com', 'example.ru', 'domain.ru', 'sentry.io', 'wixpress.com', 'sentry.wixpress.com')
+
+class WebsiteCrawler:
+    """Ищет email на сайте организации: главная страница и типовые страницы контактов.
+    
+    Страницы скачиваются параллельно (CRAWLER_WORKERS потоков), к одному хосту —
+    не больше CRAWLER_PER_HOST_CONCURRENCY запросов одновременно и не чаще
+    одного раза в CRAWLER_HOST_DELAY секунд. Ответ читается не дальше
+    CRAWLER_MAX_BYTES, учитываются только HTML-страницы.
+    """
+    def __init__(self, workers=CRAWLER_WORKERS, per_host=CRAWLER_PER_HOST_CONCURRENCY, host_delay=CRAWLER_HOST_DELAY,
+                 max_bytes=CRAWLER_MAX_BYTES, timeout=(CRAWLER_CONNECT_TIMEOUT, CRAWLER_READ_TIMEOUT)):
+        self.workers = workers
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        # Отдельная сессия: сайты организаций не должны занимать пулы транспорта внешних API
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=workers, pool_maxsize=per_host, max_retries=0))
+        self.session.mount('https://', HTTPAdapter(pool_connections=workers, pool_maxsize=per_host, max_retries=0))
+        self.session.headers['User-Agent'] = 'Mozilla/5.0 (compatible; ResortSearchBot/1.0)'
+        self.lock = threading.Lock()
+        self.host_slots = {}
+        self.host_next_time = {}
+    
+    def host_slot(self, host):
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.Semaphore(self.per_host)
+            return self.host_slots[host]
+    
+    def wait_for_host(self, host):
+        """Выдерживает паузу между запросами к одному хосту"""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.host_next_time.get(host, now), now)
+            self.host_next_time[host] = slot + self.host_delay
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def fetch_page(self, url, stop_flag=None):
+        """Скачивает HTML-страницу не больше max_bytes. Возвращает текст или None"""
+        if stop_flag and stop_flag():
+            return None
+        host = urlsplit(url).netloc
+        with self.host_slot(host):
+            self.wait_for_host(host)
+            try:
+                with self.session.get(url, timeout=self.timeout, stream=True, allow_redirects=True) as response:
+                    if response.status_code != 200 or 'html' not in response.headers.get('Content-Type', 'text/html'):
+                        return None
+                    body = b''
+                    for chunk in response.iter_content(16384):
+                        body += chunk
+                        if len(body) >= self.max_bytes:
+                            break
+                    return body[:self.max_bytes].decode(response.encoding or 'utf-8', errors='replace')
+            except (requests.RequestException, ValueError) as e:
+                email_logger.debug("Страница %s недоступна: %s", url, e)
+                return None
+    
+    @staticmethod
+    def extract_emails(page):
+        """Email из ссылок mailto: и из текста страницы, без имен файлов и служебных адресов"""
+        page = html.unescape(page or '')
+        candidates = MAILTO_PATTERN.findall(page)
+        candidates += EMAIL_PATTERN.findall(page)
+        emails = []
+        for candidate in candidates:
+            email = extract_email(requests.utils.unquote(candidate))
+            if not email or email.endswith(EMAIL_JUNK_SUFFIXES) or email.split('@')[1] in EMAIL_JUNK_DOMAINS:
+                continue
+            if email not in emails:
+                emails.append(email)
+        return emails
+    
+    @staticmethod
+    def site_root(website):
+        website = (website or '').strip()
+        if not website:
+            return None
+        if not re.match(r'^https?://', website, re.IGNORECASE):
+            website = f"http://{website}"
+        parts = urlsplit(website)
+        return f"{parts.scheme}://{parts.netloc}" if parts.netloc else None
+    
+    def pick_email(self, emails, website):
+        """Адрес на домене сайта организации (или его поддомене); адреса чужих доменов не берутся"""
+        domain = normalize_website(website).split('/')[0].split(':')[0]
+        if not domain:
+            return None
+        for email in emails:
+            email_domain = email.split('@')[1]
+            if email_domain == domain or email_domain.endswith('.' + domain) or domain.endswith('.' + email_domain):
+                return email
+        return None
+    
+    def crawl_many(self, organizations, stop_flag=None):
+        """Ищет email на сайтах организаций {ключ: организация}. Возвращает {ключ: email}
+        
+        Обходятся только сайты из ответа API: заглушка, собранная из названия,
+        может оказаться чужим доменом.
+        """
+        tasks = {}
+        for key, org in organizations.items():
+            root = self.site_root(org.known_website)
+            if root:
+                tasks[key] = root
+        if not tasks:
+            return {}
+        
+        emails_by_key = {key: [] for key in tasks}
+        executor = ThreadPoolExecutor(max_workers=max(1, self.workers))
+        try:
+            futures = {}
+            for key, root in tasks.items():
+                for path in CRAWLER_PATHS:
+                    future = executor.submit(contextvars.copy_context().run, self.fetch_page, root + path, stop_flag)
+                    futures[future] = key
+            for future in as_completed(futures):
+                page = future.result()
+                if page:
+                    for email in self.extract_emails(page):
+                        if email not in emails_by_key[futures[future]]:
+                            emails_by_key[futures[future]].append(email)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        found = {}
+        for key, emails in emails_by_key.items():
+            email = self.pick_email(emails, organizations[key].known_website)
+            if email:
+                found[key] = email
+        email_logger.info("🕸️ На сайтах найдено email: %s из %s", len(found), len(tasks))
+        return found
+
+website_crawler = WebsiteCrawler()
+
+def enrich_emails(organizations, stop_flag=None, on_result=None, concurrency=None):
+    """Параллельный поиск email для организаций через LLM.
+    
+    organizations — словарь {ключ: организация}. Организации делятся на пакеты
+    по LLM_EMAIL_BATCH_SIZE и ставятся в очередь; пул из concurrency потоков
+    (по умолчанию LLM_EMAIL_CONCURRENCY) разбирает очередь, соблюдая общий
+    бюджет LLM_REQUESTS_PER_MINUTE. Флаг остановки проверяется перед каждым
+    пакетом. on_result(ключ, результат) вызывается по мере готовности пакетов,
+    вызовы сериализованы. Возвращает количество обработанных организаций.
+    """
+    work = queue.Queue()
+    keys = list(organizations.keys())
+    batch_size = max(1, LLM_EMAIL_BATCH_SIZE)
+    for start in range(0, len(keys), batch_size):
+        work.put(keys[start:start + batch_size])
+    
+    result_lock = threading.Lock()
+    processed = [0]
+    job = contextvars.copy_context()
+    
+    def worker():
+        while not (stop_flag and stop_flag()):
+            try:
+                batch = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results = proxy_api.search_emails_batch({key: organizations[key] for key in batch}, stop_flag)
+            except Exception as e:
+                email_logger.error("❌ Исключение при пакетном поиске email: %s", e)
+                continue
+            with result_lock:
+                for key, result in results.items():
+                    if on_result:
+                        on_result(key, result)
+                    processed[0] += 1
+    
+    workers = [
+        threading.Thread(target=job.copy().run, args=(worker,), daemon=True)
+        for _ in range(max(1, min(concurrency or LLM_EMAIL_CONCURRENCY, work.qsize())))
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    
+    return processed[0]
 
 # Инициализация API клиентов
 yandex_api = YandexSearchAPI()
@@ -590,12 +3064,12 @@ def determine_region_by_coordinates(lat, lon):
 
 def search_cities_2gis(city_name):
     """Поиск городов через 2GIS API"""
-    print(f"🗺️ Используем 2GIS API для поиска: '{city_name}'")
+    api_logger.info("🗺️ Используем 2GIS API для поиска: '%s'", city_name)
     
     # Получаем API ключ 2GIS
     api_key = os.getenv('2GIS_API_KEY')
     if not api_key:
-        print("❌ API ключ 2GIS не найден")
+        api_logger.warning("❌ API ключ 2GIS не найден")
         return jsonify({'error': 'API ключ 2GIS не настроен'}), 500
     
     # 2GIS API для поиска городов
@@ -610,12 +3084,12 @@ def search_cities_2gis(city_name):
     }
     
     try:
-        response = requests.get(search_url, params=params, timeout=10)
-        print(f"📡 2GIS ответ: статус {response.status_code}")
+        response = http_transport.get(search_url, params=params)
+        api_logger.info("📡 2GIS ответ: статус %s", response.status_code)
         
         if response.status_code == 200:
             data = response.json()
-            print(f"📊 2GIS нашел {len(data.get('result', {}).get('items', []))} объектов")
+            api_logger.info("📊 2GIS нашел %s объектов", len(data.get('result', {}).get('items', [])))
             
             cities = []
             items = data.get('result', {}).get('items', [])
@@ -631,7 +3105,7 @@ def search_cities_2gis(city_name):
                     lon = float(point['lon'])
                     lat = float(point['lat'])
                 else:
-                    print(f"  [{i+1}] {name} - НЕТ КООРДИНАТ (пропускаем)")
+                    api_logger.debug("  [%s] %s - НЕТ КООРДИНАТ (пропускаем)", i + 1, name)
                     continue
                 
                 # Фильтруем только административные единицы (города, районы)
@@ -670,27 +3144,26 @@ def search_cities_2gis(city_name):
                         'search_type': '2gis'
                     }
                     cities.append(city_info)
-                    print(f"  [{i+1}] {name} ({item_type}) - ГОРОД")
-                    print(f"      Полное название: {full_name}")
-                    print(f"      Регион: {region}")
-                    print(f"      Координаты: {lat}, {lon}")
+                    api_logger.debug("  [%s] %s (%s) - ГОРОД", i + 1, name, item_type)
+                    api_logger.debug("      Полное название: %s", full_name)
+                    api_logger.debug("      Регион: %s", region)
+                    api_logger.debug("      Координаты: %s, %s", lat, lon)
                 else:
-                    print(f"  [{i+1}] {name} ({item_type}) - НЕ ГОРОД (пропускаем)")
+                    api_logger.debug("  [%s] %s (%s) - НЕ ГОРОД (пропускаем)", i + 1, name, item_type)
             
             if cities:
-                print(f"✅ 2GIS нашел {len(cities)} городов")
+                api_logger.info("✅ 2GIS нашел %s городов", len(cities))
                 return jsonify({'cities': cities})
             else:
-                print("❌ 2GIS не нашел городов")
+                api_logger.warning("❌ 2GIS не нашел городов")
                 return jsonify({'error': 'Проверьте правильность написания названия города'}), 404
                 
         else:
-            print(f"❌ Ошибка 2GIS: {response.status_code}")
-            print(f"Ответ сервера: {response.text[:200]}...")
+            api_logger.error("❌ Ошибка 2GIS: %s, ответ сервера: %s...", response.status_code, response.text[:200])
             return jsonify({'error': 'Ошибка при обращении к 2GIS API'}), 500
             
     except Exception as e:
-        print(f"❌ Исключение 2GIS: {e}")
+        api_logger.error("❌ Исключение 2GIS: %s", e)
         return jsonify({'error': 'Ошибка при поиске городов'}), 500
 
 # def search_cities_nominatim(city_name):
@@ -771,25 +3244,288 @@ def search_cities_2gis(city_name):
 @app.route('/api/search_cities', methods=['POST'])
 def search_cities():
     """Поиск городов через 2GIS API"""
-    print(f"🏙️ Получен запрос на поиск городов")
+    api_logger.info("🏙️ Получен запрос на поиск городов")
     
     data = request.json
     city_name = data.get('city', '').strip()
     
-    print(f"🔍 Ищем город: '{city_name}'")
+    api_logger.info("🔍 Ищем город: '%s'", city_name)
     
     if not city_name:
-        print("❌ Ошибка: Название города не указано")
+        api_logger.warning("❌ Ошибка: Название города не указано")
         return jsonify({'error': 'Название города не указано'}), 400
     
     # Используем 2GIS API для поиска городов
     return search_cities_2gis(city_name)
 
+# Пакетный поиск: предел числа областей в одной задаче и сколько из них ищется одновременно
+BULK_SEARCH_MAX_AREAS = int(os.getenv('BULK_SEARCH_MAX_AREAS', 20))
+BULK_SEARCH_CONCURRENCY = int(os.getenv('BULK_SEARCH_CONCURRENCY', 2))
+
+def run_search_job(job, stop_flag):
+    """Выполняет задачу поиска организаций; возвращает (состояние, ошибка)
+    
+    Пакетная задача (params['areas']) обходит несколько городов и кругов с общими дедупликацией
+    и списком результатов, поэтому пересекающиеся области дают один объединенный набор данных.
+    """
+    params = job['params']
+    city = params.get('city', '')
+    coordinates = params.get('coordinates')
+    radius = params.get('radius', 5)
+    selected_types = params.get('types', [])
+    by_coordinates = bool(coordinates and len(coordinates) == 2)
+    bulk = bool(params.get('areas'))
+    areas = params['areas'] if bulk else [
+        {'coordinates': coordinates, 'radius': radius} if by_coordinates else {'city': city}
+    ]
+    
+    # Прогресс пакетной задачи складывается из прогресса всех областей
+    results = []
+    results_lock = threading.Lock()
+    dedup_index = OrganizationIndex()
+    processed_by_area = [0] * len(areas)
+    progress_lock = threading.Lock()
+    
+    def on_event(event, data):
+        try:
+            job_registry.add_event(job['id'], event, data)
+        except sqlite3.Error as e:
+            storage_logger.warning("⚠️ Ошибка записи события задачи: %s", e)
+    
+    def search_area(index, area):
+        def on_progress(processed_types, found):
+            with progress_lock:
+                processed_by_area[index] = processed_types
+                processed = sum(processed_by_area)
+            try:
+                job_registry.update(job['id'], processed=processed, found=found)
+            except sqlite3.Error as e:
+                storage_logger.warning("⚠️ Ошибка обновления прогресса задачи: %s", e)
+        
+        area_coordinates = area.get('coordinates')
+        if area_coordinates and len(area_coordinates) == 2:
+            search_logger.info("🎯 Область %s/%s: круг %s, радиус %s км",
+                               index + 1, len(areas), area_coordinates, area.get('radius', 5))
+            return yandex_api.search_organizations(
+                city=None,
+                selected_types=selected_types,
+                stop_flag=stop_flag,
+                coordinates=area_coordinates,
+                radius=area.get('radius', 5),
+                dedup_index=dedup_index,
+                on_progress=on_progress,
+                on_event=on_event,
+                results=results,
+                results_lock=results_lock
+            )
+        search_logger.info("🏙️ Область %s/%s: город %s", index + 1, len(areas), area.get('city'))
+        return yandex_api.search_organizations(
+            city=area.get('city'),
+            selected_types=selected_types,
+            stop_flag=stop_flag,
+            dedup_index=dedup_index,
+            on_progress=on_progress,
+            on_event=on_event,
+            results=results,
+            results_lock=results_lock
+        )
+    
+    search_logger.info("🚀 Запуск поиска организаций в городе: %s (задача %s, областей: %s)",
+                       city or job['dataset'], job['id'], len(areas))
+    job_registry.update(job['id'], total=len(selected_types) * len(areas))
+    
+    if len(areas) == 1:
+        area_results = [search_area(0, areas[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(BULK_SEARCH_CONCURRENCY, len(areas)))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, search_area, index, area)
+                       for index, area in enumerate(areas)]
+            area_results = [future.result() for future in futures]
+    
+    errors = [result['error'] for result in area_results if 'error' in result]
+    if errors:
+        search_logger.error("❌ Ошибка поиска: %s", errors[0])
+        return 'failed', errors[0]
+    
+    organizations = results
+    duplicates = [org for result in area_results for org in result.get('duplicates', [])]
+    coverage = [circle for result in area_results for circle in result.get('coverage', [])]
+    search_logger.info("✅ Поиск завершен. Найдено %s организаций", len(organizations))
+    
+    # Сохраняем данные в хранилище для экспорта; прежний состав поиска заменяется
+    if bulk:
+        organization_store.save_search(job['dataset'], organizations, types=selected_types, duplicates=duplicates,
+                                       coverage=coverage)
+    elif by_coordinates:
+        organization_store.save_search(job['dataset'], organizations, city=city or None,
+                                       center=coordinates, radius=radius, types=selected_types, duplicates=duplicates,
+                                       coverage=coverage)
+    else:
+        organization_store.save_search(job['dataset'], organizations, city=city, types=selected_types,
+                                       duplicates=duplicates)
+    dataset_snapshots.write(job['dataset'])
+    job_registry.update(job['id'], found=len(organizations))
+    return ('stopped' if stop_flag() else 'completed'), None
+
+def run_email_job(job, stop_flag):
+    """Выполняет задачу поиска email для набора данных; возвращает (состояние, ошибка)"""
+    dataset_name = job['dataset']
+    # Загружаем данные из хранилища: найденные до прерывания email уже сохранены в нем
+    organizations = load_organizations_data(dataset_name, use_cache=False)
+    if not organizations:
+        return 'failed', 'Сначала найдите организации'
+    
+    # Организации с непустым email (включая «не найден») уже обработаны и повторно не запрашиваются
+    checkpoint = {
+        'status': 'running',
+        'total': len(organizations),
+        'processed': sum(1 for org in organizations if org.email),
+    }
+    unsaved = []
+    save_lock = threading.Lock()
+    
+    def persist(status=None):
+        """Записывает новые email и контрольную точку в хранилище"""
+        with save_lock:
+            if status:
+                checkpoint['status'] = status
+            checkpoint['updated'] = datetime.now().isoformat(timespec='seconds')
+            try:
+                organization_store.update_emails([organizations[i] for i in unsaved])
+                organization_store.save_progress(dataset_name, checkpoint)
+                if unsaved:
+                    job_registry.add_event(job['id'], 'organizations', {
+                        'organizations': [dict(organizations[i].to_dict(), position=i) for i in unsaved],
+                    })
+                job_registry.update(job['id'], processed=checkpoint['processed'], total=checkpoint['total'])
+                unsaved.clear()
+            except Exception as e:
+                storage_logger.error("❌ Ошибка сохранения контрольной точки: %s", e)
+    
+    def record(i, email):
+        organizations[i].email = email
+        checkpoint['processed'] += 1
+        unsaved.append(i)
+        if len(unsaved) >= EMAIL_CHECKPOINT_EVERY:
+            persist()
+    
+    status, error = 'failed', None
+    try:
+        persist()
+        pending = {i: org for i, org in enumerate(organizations) if not org.email}
+        
+        # Сначала подставляем адреса из кэша, в LLM отправляем только остальные
+        for i, email in email_cache.get_many(pending).items():
+            record(i, email)
+            del pending[i]
+        
+        # Затем ищем адреса на сайтах организаций, LLM — только для оставшихся
+        for i, email in website_crawler.crawl_many(pending, stop_flag).items():
+            email_cache.put(organizations[i], email)
+            record(i, email)
+            del pending[i]
+        email_logger.info("✉️ Поиск email для %s организаций: пакеты по %s, потоков %s",
+                          len(pending), LLM_EMAIL_BATCH_SIZE, LLM_EMAIL_CONCURRENCY)
+        
+        def on_result(i, result):
+            if 'email' in result:
+                email_cache.put(organizations[i], result['email'])
+                record(i, result['email'])
+        
+        processed = enrich_emails(pending, stop_flag, on_result)
+        email_logger.info("✉️ Поиск email завершен: обработано %s из %s", processed, len(pending))
+        status = 'stopped' if stop_flag() else 'completed'
+    except Exception as e:
+        error = str(e)
+        email_logger.error("Ошибка поиска email: %s", e)
+    finally:
+        persist(status)
+        dataset_snapshots.write(dataset_name)
+    return status, error
+
+job_scheduler = JobScheduler(job_registry, {'search_names': run_search_job, 'search_emails': run_email_job})
+
+def parse_optional_int(args, name):
+    """Целочисленный параметр запроса или None; ValueError с именем параметра при ошибке"""
+    value = args.get(name, '').strip()
+    if not value:
+        return None
+    if not value.lstrip('-').isdigit():
+        raise ValueError(name)
+    return int(value)
+
+def organization_filter(args):
+    """Фильтр организаций: (типы из параметра type, условие по has_email и bbox или None)"""
+    types = {part.strip() for value in args.getlist('type') for part in value.split(',') if part.strip()}
+    has_email = args.get('has_email', '').strip().lower()
+    if has_email and has_email not in ('1', '0', 'true', 'false'):
+        raise ValueError('has_email')
+    has_email = None if not has_email else has_email in ('1', 'true')
+    bbox = args.get('bbox', '').strip()
+    if bbox:
+        try:
+            parts = [float(part) for part in bbox.split(',')]
+        except ValueError:
+            raise ValueError('bbox')
+        if len(parts) != 4:
+            raise ValueError('bbox')
+        min_lat, max_lat = sorted((parts[0], parts[2]))
+        min_lon, max_lon = sorted((parts[1], parts[3]))
+    if has_email is None and not bbox:
+        return types, None
+    
+    def matches(org):
+        if has_email is not None and (bool(org.email) and org.email != EMAIL_NOT_FOUND) != has_email:
+            return False
+        if bbox and (org.lon is None or not (min_lon <= org.lon <= max_lon and min_lat <= org.lat <= max_lat)):
+            return False
+        return True
+    return types, matches
+
+def select_page(organizations, types, matches, cursor, limit):
+    """Страница подходящих организаций начиная с позиции cursor и курсор следующей страницы (None — конец)"""
+    if not types and matches is None:
+        end = len(organizations) if limit is None else cursor + limit
+        return organizations[cursor:end], (end if end < len(organizations) else None)
+    page = []
+    for position in range(cursor, len(organizations)):
+        org = organizations[position]
+        if (not types or org.type in types) and (matches is None or matches(org)):
+            if limit is not None and len(page) == limit:
+                return page, position
+            page.append(organizations[position])
+    return page, None
+
+def client_id():
+    """Идентификатор клиента для честной очереди: заголовок X-Client-Id, параметр client_id
+    (EventSource не передает своих заголовков) или адрес"""
+    client = request.headers.get('X-Client-Id', '').strip() or request.args.get('client_id', '').strip()
+    return client[:64] or request.remote_addr or ''
+
+def submit_job(kind, dataset, params, budget=None):
+    """Ставит задачу в очередь и сразу пробует ее запустить; None, если такая задача уже активна"""
+    job_scheduler.ensure_started()
+    if budget is None:
+        budget = JOB_BUDGETS.get(kind, 0)
+    job_id = job_registry.create(kind, dataset, params, client=client_id(), budget=budget, exclusive=True)
+    if job_id is not None:
+        job_scheduler.dispatch()
+    return job_id
+
+def job_response(job_id, message):
+    """Ответ о постановке задачи: ID, состояние и, если задача ждет, место в очереди и оценка старта"""
+    job = job_registry.get(job_id)
+    response = {'message': message, 'job_id': job_id, 'state': job['state']}
+    if job['state'] == 'queued':
+        estimate = job_registry.queue_status()['estimates'].get(job_id, {})
+        response.update(queue_position=estimate.get('position'), eta_seconds=estimate.get('eta_seconds'))
+        response['message'] = (f"{message}: задача в очереди, позиция {response['queue_position']}, "
+                               f"ожидаемый старт через ~{response['eta_seconds']} с")
+    return response
+
 @app.route('/api/search_organizations', methods=['POST'])
 def search_organizations():
-    global organizations_data, current_processes
-    
-    print(f"🚀 Получен запрос на поиск организаций")
+    api_logger.info("🚀 Получен запрос на поиск организаций")
     data = request.json
     
     # Поддерживаем как старый формат (по названию города), так и новый (по координатам)
@@ -798,208 +3534,254 @@ def search_organizations():
     radius = data.get('radius', 5)  # Радиус в км, по умолчанию 5
     selected_types = data.get('types', [])
     
-    print(f"🏙️ Город: '{city}'")
-    print(f"📍 Координаты: {coordinates}")
-    print(f"📏 Радиус: {radius} км")
-    print(f"📋 Выбранные типы: {selected_types}")
-    print(f"📊 Количество типов: {len(selected_types)}")
+    api_logger.debug("🏙️ Город: '%s'", city)
+    api_logger.debug("📍 Координаты: %s", coordinates)
+    api_logger.debug("📏 Радиус: %s км", radius)
+    api_logger.debug("📋 Выбранные типы: %s", selected_types)
+    api_logger.debug("📊 Количество типов: %s", len(selected_types))
     
     # Проверяем параметры
     if not coordinates and not city:
-        print("❌ Ошибка: Не указаны ни город, ни координаты")
+        api_logger.warning("❌ Ошибка: Не указаны ни город, ни координаты")
         return jsonify({'error': 'Не указаны ни город, ни координаты'}), 400
     
     if not selected_types:
-        print("❌ Ошибка: Не выбраны типы организаций")
+        api_logger.warning("❌ Ошибка: Не выбраны типы организаций")
         return jsonify({'error': 'Не выбраны типы организаций'}), 400
     
     # Если переданы координаты, используем новый алгоритм
     if coordinates and len(coordinates) == 2:
         lon, lat = coordinates
-        print(f"🎯 Используем поиск по координатам: {lat:.6f}, {lon:.6f}, радиус {radius} км")
+        api_logger.info("🎯 Используем поиск по координатам: %.6f, %.6f, радиус %s км", lat, lon, radius)
     else:
-        print(f"🏙️ Используем поиск по названию города: {city}")
+        api_logger.info("🏙️ Используем поиск по названию города: %s", city)
         if not city:
-            print("❌ Ошибка: Город не указан")
+            api_logger.warning("❌ Ошибка: Город не указан")
             return jsonify({'error': 'Город не указан'}), 400
     
-    # Сброс данных при каждом поиске
-    global organizations_data
-    organizations_data = []
+    # Для поиска по координатам используем специальное имя набора данных
+    by_coordinates = bool(coordinates and len(coordinates) == 2)
+    dataset_name = f"coords_{coordinates[1]:.4f}_{coordinates[0]:.4f}_r{radius}" if by_coordinates else city
     
-    current_processes['search_names'] = True
+    job_id = submit_job('search_names', dataset_name, {
+        'city': city, 'coordinates': coordinates, 'radius': radius, 'types': selected_types,
+    })
+    if job_id is None:
+        api_logger.warning("❌ Поиск организаций для '%s' уже выполняется", dataset_name)
+        return jsonify({'error': 'Поиск организаций в этой области уже выполняется'}), 409
     
-    def search_task():
-        global organizations_data, current_processes
+    return jsonify(job_response(job_id, f'Поиск организаций в городе {city} запущен'))
+
+def parse_search_area(area):
+    """Проверяет область пакетного поиска: {'city': ...} или {'coordinates': [lon, lat], 'radius': км}"""
+    if not isinstance(area, dict):
+        raise ValueError('Область поиска должна быть объектом')
+    coordinates = area.get('coordinates')
+    if coordinates:
         try:
-            print(f"🚀 Запуск поиска организаций в городе: {city}")
-            print(f"Флаг остановки: {current_processes['search_names']}")
-            
-            # Передаем параметры в зависимости от режима поиска
-            if coordinates and len(coordinates) == 2:
-                result = yandex_api.search_organizations(
-                    city=None, 
-                    selected_types=selected_types, 
-                    stop_flag=lambda: not current_processes['search_names'],
-                    coordinates=coordinates,
-                    radius=radius
-                )
-            else:
-                result = yandex_api.search_organizations(
-                    city=city, 
-                    selected_types=selected_types, 
-                    stop_flag=lambda: not current_processes['search_names']
-                )
-            
-            print(f"🔍 Результат поиска: {result}")
-            
-            if 'error' not in result:
-                global organizations_data
-                organizations_data = result['organizations']
-                print(f"✅ Поиск завершен. Найдено {len(organizations_data)} организаций")
-                print(f"📊 Данные сохранены в organizations_data: {len(organizations_data)} элементов")
-                print(f"🔍 Проверка: organizations_data содержит {len(organizations_data)} элементов")
-                
-                # Сохраняем данные в файл для экспорта
-                if coordinates and len(coordinates) == 2:
-                    # Для поиска по координатам используем специальное имя файла
-                    city_name_for_file = f"coords_{coordinates[1]:.4f}_{coordinates[0]:.4f}_r{radius}"
-                    # Удаляем старый файл если существует
-                    old_filepath = os.path.join('exports', f"data_{city_name_for_file.replace(' ', '_')}.pkl")
-                    if os.path.exists(old_filepath):
-                        os.remove(old_filepath)
-                        print(f"🗑️ Удален старый файл: {old_filepath}")
-                    save_organizations_data(organizations_data, city_name_for_file)
-                else:
-                    # Удаляем старый файл если существует
-                    old_filepath = os.path.join('exports', f"data_{city.replace(' ', '_')}.pkl")
-                    if os.path.exists(old_filepath):
-                        os.remove(old_filepath)
-                        print(f"🗑️ Удален старый файл: {old_filepath}")
-                    save_organizations_data(organizations_data, city)
-            else:
-                print(f"❌ Ошибка поиска: {result['error']}")
-                
-        except Exception as e:
-            print(f"❌ Исключение в поиске организаций: {e}")
-        finally:
-            current_processes['search_names'] = False
-            print(f"🏁 Процесс поиска названий завершен. Флаг: {current_processes['search_names']}")
+            lon, lat = (float(value) for value in coordinates)
+            radius = float(area.get('radius', 5))
+        except (TypeError, ValueError):
+            raise ValueError('Ошибка парсинга координат области')
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90) or radius <= 0:
+            raise ValueError('Некорректные координаты или радиус области')
+        return {'coordinates': [lon, lat], 'radius': int(radius) if radius.is_integer() else radius}
+    city = str(area.get('city') or '').strip()
+    if not city:
+        raise ValueError('Для области не указаны ни город, ни координаты')
+    return {'city': city}
+
+@app.route('/api/search_organizations_bulk', methods=['POST'])
+def search_organizations_bulk():
+    """Запускает одну задачу поиска по нескольким городам и кругам с общим набором данных"""
+    data = request.get_json(silent=True) or {}
+    selected_types = data.get('types', [])
+    raw_areas = data.get('areas') or []
+    
+    if not isinstance(raw_areas, list) or not raw_areas:
+        return jsonify({'error': 'Не указаны области поиска'}), 400
+    if len(raw_areas) > BULK_SEARCH_MAX_AREAS:
+        return jsonify({'error': f'Слишком много областей: не более {BULK_SEARCH_MAX_AREAS}'}), 400
+    if not selected_types:
+        return jsonify({'error': 'Не выбраны типы организаций'}), 400
+    try:
+        areas = [parse_search_area(area) for area in raw_areas]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Одинаковые области ищутся один раз; имя набора данных по умолчанию определяется составом областей.
+    # Пакетные наборы именуются с префиксом bulk_, чтобы не заменить состав поиска по городу или кругу
+    areas = list({json.dumps(area, sort_keys=True): area for area in areas}.values())
+    name = str(data.get('name') or '').strip()[:100] or \
+        hashlib.sha1(json.dumps(areas, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    dataset_name = f'bulk_{name}'
+    api_logger.info("🚀 Пакетный поиск '%s': областей %s, типов %s", dataset_name, len(areas), len(selected_types))
     
-    # Запуск в отдельном потоке
-    thread = threading.Thread(target=search_task)
-    thread.start()
+    job_id = submit_job('search_names', dataset_name, {'areas': areas, 'types': selected_types},
+                        budget=JOB_BUDGETS.get('search_names', 0) * len(areas))
+    if job_id is None:
+        api_logger.warning("❌ Поиск организаций для '%s' уже выполняется", dataset_name)
+        return jsonify({'error': 'Поиск организаций в этой области уже выполняется'}), 409
     
-    return jsonify({'message': f'Поиск организаций в городе {city} запущен'})
+    response = job_response(job_id, f'Пакетный поиск по {len(areas)} областям запущен')
+    response.update(dataset=dataset_name, areas=len(areas))
+    return jsonify(response)
 
 @app.route('/api/search_emails', methods=['POST'])
 def search_emails():
-    global organizations_data, current_processes
-    
-    # Получаем город из запроса для загрузки данных
-    data = request.json
+    # Получаем город или координаты из запроса для загрузки данных
+    data = request.get_json(silent=True) or {}
     city = data.get('city', '').strip()
+    coordinates = data.get('coordinates', '')
+    radius = data.get('radius', 5)
     
-    # Загружаем данные из файла
-    organizations_data = load_organizations_data(city)
-    
-    if not organizations_data:
+    try:
+        dataset_name = dataset_name_from_request(city, coordinates, radius) or latest_dataset_name()
+    except ValueError:
+        return jsonify({'error': 'Ошибка парсинга координат'}), 400
+    if not dataset_name:
         return jsonify({'error': 'Сначала найдите организации'}), 400
     
-    current_processes['search_emails'] = True
+    # Достаточно первой записи; старые pkl-файлы импортируются при полной загрузке
+    if not (organization_store.load_search(dataset_name, limit=1) or load_organizations_data(dataset_name)):
+        return jsonify({'error': 'Сначала найдите организации'}), 400
     
-    def email_search_task():
-        global organizations_data, current_processes
-        try:
-            for i, org in enumerate(organizations_data):
-                if not current_processes['search_emails']:
-                    break
-                
-                if not org.get('email'):
-                    result = proxy_api.search_email(org['name'], org.get('city', ''), 
-                                                  lambda: not current_processes['search_emails'])
-                    if 'email' in result:
-                        organizations_data[i]['email'] = result['email']
-                
-                time.sleep(1)  # Задержка между запросами
-        except Exception as e:
-            print(f"Ошибка поиска email: {e}")
-        finally:
-            current_processes['search_emails'] = False
+    previous = organization_store.load_progress(dataset_name)
+    resumed = bool(previous and previous.get('status') != 'completed')
+    if resumed:
+        email_logger.info("♻️ Продолжаем прерванный поиск email для '%s': обработано %s из %s",
+                          dataset_name, previous.get('processed', 0), previous.get('total', 0))
     
-    thread = threading.Thread(target=email_search_task)
-    thread.start()
+    job_id = submit_job('search_emails', dataset_name, {'city': city, 'coordinates': coordinates, 'radius': radius})
+    if job_id is None:
+        return jsonify({'error': 'Поиск email для этих организаций уже выполняется'}), 409
     
-    return jsonify({'message': 'Поиск email адресов запущен'})
-
+    response = job_response(job_id, 'Поиск email адресов запущен')
+    if resumed:
+        response['resumed_from'] = previous.get('processed', 0)
+    return jsonify(response)
 
 @app.route('/api/get_organizations', methods=['GET'])
 def get_organizations():
-    global organizations_data
+    """Организации набора данных с фильтрами, постраничной выдачей и синхронизацией по версии.
     
+    Набор данных: city, coordinates и radius, иначе последний поиск клиента.
+    Фильтры: type (несколько через запятую), has_email (1/0) и bbox
+    («широта,долгота,широта,долгота» — противоположные углы). Страница: limit
+    и cursor из next_cursor предыдущего ответа; total и type_counts — размер набора
+    и число организаций каждого типа без учета фильтров. since=<version> возвращает
+    только организации, измененные после этой версии (с полем position).
+    Версия набора передается в ETag, при совпадении If-None-Match — ответ 304.
+    """
     # Получаем параметры из запроса
     city = request.args.get('city', '').strip()
     coordinates = request.args.get('coordinates', '').strip()
     radius = request.args.get('radius', '5').strip()
     
-    # Сначала проверяем глобальные данные
-    if organizations_data:
-        print(f"📤 Возвращаем данные из глобальной переменной: {len(organizations_data)} организаций")
-        data_to_return = organizations_data
-    elif city:
-        # Загружаем данные из файла по названию города
-        data_to_return = load_organizations_data(city)
-        print(f"📤 Запрос на получение организаций для города '{city}'. Загружено: {len(data_to_return)} организаций")
+    try:
+        types, matches = organization_filter(request.args)
+        limit = parse_optional_int(request.args, 'limit')
+        cursor = max(0, parse_optional_int(request.args, 'cursor') or 0)
+        since = parse_optional_int(request.args, 'since')
+    except ValueError as e:
+        return jsonify({'error': f'Неверный параметр запроса: {e}'}), 400
+    if limit is not None:
+        limit = max(1, min(limit, ORGANIZATIONS_PAGE_MAX))
+    
+    if city:
+        dataset_name = city
+        api_logger.debug("📤 Запрос на получение организаций для города '%s'", city)
     elif coordinates:
-        # Загружаем данные из файла по координатам
         try:
-            coords_parts = coordinates.split(',')
-            if len(coords_parts) == 2:
-                lat, lon = float(coords_parts[0]), float(coords_parts[1])
-                city_name_for_file = f"coords_{lat:.4f}_{lon:.4f}_r{radius}"
-                data_to_return = load_organizations_data(city_name_for_file)
-                print(f"📤 Запрос на получение организаций для координат '{coordinates}', радиус {radius} км. Загружено: {len(data_to_return)} организаций")
-            else:
-                data_to_return = []
-                print(f"❌ Неверный формат координат: {coordinates}")
+            dataset_name = dataset_name_from_request(coordinates=coordinates, radius=radius) or None
         except ValueError:
-            data_to_return = []
-            print(f"❌ Ошибка парсинга координат: {coordinates}")
+            dataset_name = None
+        if dataset_name:
+            api_logger.debug("📤 Запрос на получение организаций для координат '%s', радиус %s км", coordinates, radius)
+        else:
+            api_logger.warning("❌ Неверный формат координат: %s", coordinates)
     else:
-        # Если ни город, ни координаты не указаны, возвращаем пустой список
-        data_to_return = []
-        print(f"📤 Запрос на получение организаций без указания города или координат. Возвращаем пустой список.")
-    
-    print(f"📊 Текущие процессы: {current_processes}")
-    
-    if data_to_return:
-        print(f"📤 Отправляем {len(data_to_return)} организаций")
-        for i, org in enumerate(data_to_return[:5]):  # Показываем только первые 5 для краткости
-            print(f"  [{i+1}] {org.get('name', 'Без названия')} - ID: {org.get('yandex_id', 'Нет')} - Тип: {org.get('type', 'Нет')}")
-        if len(data_to_return) > 5:
-            print(f"  ... и еще {len(data_to_return) - 5} организаций")
+        # Без параметров возвращаем результат последнего поиска
+        dataset_name = latest_dataset_name()
+        api_logger.debug("📤 Запрос без города и координат: последний поиск %s", dataset_name)
+    
+    version = organization_store.search_version(dataset_name) if dataset_name else None
+    if dataset_name and version is None and load_organizations_data(dataset_name):
+        # Набор из старого pkl-файла: при первом обращении он импортирован в хранилище и получил версию
+        version = organization_store.search_version(dataset_name)
+    if version is not None and request.if_none_match.contains_weak(str(version)):
+        response = app.response_class(status=304)
+        response.set_etag(str(version))
+        return response
+    
+    # Для неизменной версии набора готовое тело ответа берется из кэша без сериализации и сжатия
+    encoding = negotiate_encoding()
+    body_key = (dataset_name, version, encoding,
+                tuple(sorted(item for item in request.args.items(multi=True) if item[0] != '_t')))
+    cached = encoded_body_cache.get(body_key) if version is not None else None
+    if cached is not None:
+        response = body_response(*cached)
+        response.set_etag(str(version), weak=bool(cached[1]))
+        return response
+    
+    changes = None
+    if since is not None and version is not None:
+        changes = [] if since >= version else organization_store.changed_since(dataset_name, since)
+    
+    if changes is not None:
+        # Синхронизация: только организации, измененные после версии клиента
+        organizations = [dict(org.to_dict(), position=position) for position, org in changes
+                         if (not types or org.type in types) and (matches is None or matches(org))]
+        payload = {'organizations': organizations, 'version': version, 'delta': True}
+        api_logger.debug("📤 Изменения набора %s после версии %s: %s организаций", dataset_name, since, len(organizations))
     else:
-        print("⚠️ Данные не найдены!")
-        
-    return jsonify({'organizations': data_to_return})
+        # Набор, уже загруженный в память, берется из кэша; иначе страница читается из снимка
+        # без создания записей для остальных строк
+        data = dataset_cache.get(dataset_name, version) if version is not None else None
+        snapshot = dataset_snapshots.get(dataset_name, version) if data is None else None
+        if snapshot is not None:
+            page, next_cursor = snapshot.select_page(types, matches, cursor, limit)
+            total, type_counts = len(snapshot), snapshot.count_by_type()
+        else:
+            if data is None:
+                data = load_organizations_data(dataset_name) if version is not None else []
+            page, next_cursor = select_page(data, types, matches, cursor, limit)
+            total, type_counts = len(data), dict(Counter(org.type for org in data))
+        payload = {'organizations': [org.to_dict() for org in page], 'version': version, 'delta': False,
+                   'next_cursor': next_cursor, 'total': total, 'type_counts': type_counts}
+        if page:
+            api_logger.debug("📤 Отправляем %s из %s организаций набора %s", len(page), total, dataset_name)
+        else:
+            api_logger.debug("⚠️ Данные не найдены!")
+    
+    body, body_encoding = encode_body(payload, encoding)
+    response = body_response(body, body_encoding)
+    if version is not None:
+        encoded_body_cache.put(body_key, body, body_encoding)
+        response.set_etag(str(version), weak=bool(body_encoding))
+    return response
 
 @app.route('/api/stop_process', methods=['POST'])
 def stop_process():
-    data = request.json
+    data = request.get_json(silent=True) or {}
     process_type = data.get('process_type')
+    job_id = data.get('job_id')
     
-    print(f"🛑 Запрос на остановку процесса: {process_type}")
-    print(f"Текущие процессы: {current_processes}")
+    api_logger.info("🛑 Запрос на остановку процесса: %s", job_id or process_type)
     
-    if process_type in current_processes:
-        old_value = current_processes[process_type]
-        current_processes[process_type] = False
-        print(f"✅ Процесс {process_type} остановлен (было: {old_value}, стало: {current_processes[process_type]})")
-        print(f"Обновленные процессы: {current_processes}")
-        return jsonify({'message': f'Процесс {process_type} остановлен'})
+    # Флаг отмены записывается в общий реестр, поэтому запрос может прийти в любой воркер
+    if job_id:
+        cancelled = job_registry.cancel(job_id=job_id)
+        api_logger.info("✅ Задача %s: запрошена остановка (%s)", job_id, cancelled)
+        return jsonify({'message': f'Задача {job_id} остановлена', 'cancelled': cancelled})
+    if process_type in JOB_KINDS:
+        # Без ID останавливаются только задачи этого клиента, чужие поиски не затрагиваются
+        cancelled = job_registry.cancel(kind=process_type, client=client_id())
+        api_logger.info("✅ Процесс %s: запрошена остановка задач: %s", process_type, cancelled)
+        return jsonify({'message': f'Процесс {process_type} остановлен', 'cancelled': cancelled})
     
-    print(f"❌ Неизвестный тип процесса: {process_type}")
-    print(f"Доступные процессы: {list(current_processes.keys())}")
+    api_logger.warning("❌ Неизвестный тип процесса: %s", process_type)
+    api_logger.debug("Доступные процессы: %s", JOB_KINDS)
     return jsonify({'error': 'Неизвестный тип процесса'}), 400
 
 @app.route('/api/export_excel', methods=['GET'])
@@ -1011,7 +3793,7 @@ def export_excel():
         coordinates = request.args.get('coordinates', '').strip()
         radius = request.args.get('radius', '5').strip()
         
-        print(f"📊 Параметры экспорта: city='{city_name}', coordinates='{coordinates}', radius='{radius}'")
+        api_logger.info("📊 Параметры экспорта: city='%s', coordinates='%s', radius='%s'", city_name, coordinates, radius)
         
         # Определяем источник данных
         if city_name and not coordinates:
@@ -1032,15 +3814,15 @@ def export_excel():
                         # Используем название города, переданное из frontend
                         extracted_city_name = city_name
                         file_source = f"город '{city_name}' (по координатам)"
-                        print(f"✅ Используем переданное название города: '{city_name}'")
+                        api_logger.info("✅ Используем переданное название города: '%s'", city_name)
                     else:
                         # Fallback: извлекаем название города из данных организаций
                         extracted_city_name = None
                         if data_to_export:
                             # Берем первую организацию и извлекаем город из адреса
                             first_org = data_to_export[0]
-                            full_address = first_org.get('full_address', '')
-                            print(f"🔍 Извлекаем город из адреса: '{full_address}'")
+                            full_address = first_org.full_address
+                            api_logger.debug("🔍 Извлекаем город из адреса: '%s'", full_address)
                             
                             # Ищем паттерны типа "хутор Бетта", "село Криница", "город Москва", "Геленджик"
                             import re
@@ -1054,24 +3836,24 @@ def export_excel():
                             
                             for i, pattern in enumerate(city_patterns):
                                 match = re.search(pattern, full_address, re.IGNORECASE)
-                                print(f"🔍 Паттерн {i+1}: '{pattern}' -> {match}")
+                                api_logger.debug("🔍 Паттерн %s: '%s' -> %s", i + 1, pattern, match)
                                 if match:
                                     if 'хутор' in match.group(0).lower() or 'село' in match.group(0).lower():
                                         extracted_city_name = match.group(2) if len(match.groups()) > 1 else match.group(1)
-                                        print(f"✅ Найден населенный пункт: '{extracted_city_name}'")
+                                        api_logger.info("✅ Найден населенный пункт: '%s'", extracted_city_name)
                                         break
                                     elif 'россия' in match.group(0).lower():
                                         # Для паттерна "Город, Россия" берем название города
                                         extracted_city_name = match.group(1)
-                                        print(f"✅ Найден город (Россия): '{extracted_city_name}'")
+                                        api_logger.info("✅ Найден город (Россия): '%s'", extracted_city_name)
                                         break
                                     elif i == 3:  # Паттерн для "Геленджик, улица..."
                                         extracted_city_name = match.group(1)
-                                        print(f"✅ Найден город (общий паттерн): '{extracted_city_name}'")
+                                        api_logger.info("✅ Найден город (общий паттерн): '%s'", extracted_city_name)
                                         break
                                     elif i == 4:  # Простой паттерн для "Геленджик, улица"
                                         extracted_city_name = match.group(1)
-                                        print(f"✅ Найден город (улица): '{extracted_city_name}'")
+                                        api_logger.info("✅ Найден город (улица): '%s'", extracted_city_name)
                                         break
                         
                         if extracted_city_name:
@@ -1086,7 +3868,7 @@ def export_excel():
         else:
             return jsonify({'error': 'Не указаны ни город, ни координаты'}), 400
         
-        print(f"📊 Запрос на экспорт Excel. Источник: {file_source}, Найдено организаций: {len(data_to_export)}")
+        api_logger.info("📊 Запрос на экспорт Excel. Источник: %s, Найдено организаций: %s", file_source, len(data_to_export))
         
         if not data_to_export:
             return jsonify({'error': 'Нет данных для экспорта'}), 400
@@ -1121,19 +3903,8 @@ def export_excel():
             cell.alignment = header_alignment
         
         # Записываем данные
-        for row, org in enumerate(data_to_export, 2):
-            # Форматируем координаты
-            coords = org.get('coordinates', [])
-            coords_str = f"{coords[1]:.6f}, {coords[0]:.6f}" if len(coords) >= 2 else ""
-            
-            ws.cell(row=row, column=1, value=org.get('name', ''))
-            ws.cell(row=row, column=2, value=coords_str)
-            ws.cell(row=row, column=3, value=org.get('yandex_id', ''))
-            ws.cell(row=row, column=4, value=org.get('full_address', ''))
-            ws.cell(row=row, column=5, value=org.get('website', ''))
-            ws.cell(row=row, column=6, value=org.get('email', ''))
-            ws.cell(row=row, column=7, value=org.get('type', ''))
-            ws.cell(row=row, column=8, value=org.get('city', ''))
+        for org in data_to_export:
+            ws.append(org.to_row())
         
         # Автоподбор ширины колонок
         for column in ws.columns:
@@ -1185,7 +3956,7 @@ def export_excel():
         safe_city_name = ''.join(c for c in safe_city_name if c.isalpha() or c == '_')
         filename = f"{safe_city_name} + {radius}км.xlsx"
         
-        print(f"✅ Excel файл создан: {filename}")
+        api_logger.info("✅ Excel файл создан: %s", filename)
         
         return send_file(
             excel_buffer,
@@ -1195,14 +3966,111 @@ def export_excel():
         )
         
     except Exception as e:
-        print(f"❌ Ошибка при создании Excel файла: {str(e)}")
+        api_logger.error("❌ Ошибка при создании Excel файла: %s", str(e))
         return jsonify({'error': f'Ошибка при создании Excel файла: {str(e)}'}), 500
 
+@app.route('/api/get_logs', methods=['GET'])
+def get_logs():
+    """Последние события задачи по ее ID из кольцевого буфера (в пределах текущего воркера)"""
+    job_id = (request.args.get('job_id') or '').strip()
+    if not job_id:
+        return jsonify({'error': 'Не указан job_id'}), 400
+    if job_registry.get(job_id) is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    limit = request.args.get('limit', type=int)
+    return jsonify({'job_id': job_id, 'events': job_log_buffer.get_events(job_id, limit)})
+
+# Потоки событий /api/events: длительность одного соединения, интервал опроса журнала,
+# период комментария-пинга и пауза перед переподключением клиента (мс)
+EVENT_STREAM_MAX_SECONDS = float(os.getenv('EVENT_STREAM_MAX_SECONDS', 30))
+EVENT_STREAM_POLL_INTERVAL = float(os.getenv('EVENT_STREAM_POLL_INTERVAL', 0.5))
+EVENT_STREAM_HEARTBEAT = float(os.getenv('EVENT_STREAM_HEARTBEAT', 10))
+EVENT_STREAM_RETRY_MS = int(os.getenv('EVENT_STREAM_RETRY_MS', 1000))
+
+def format_sse(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {app.json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """События задач в формате Server-Sent Events.
+    
+    С job_id — события одной задачи с начала (поток завершается событием 'end'
+    после окончания задачи), без него — новые события всех задач клиента
+    (EventSource не передает заголовки, поэтому клиент указывается параметром client_id).
+    События: 'job' (состояние и счетчики), 'tile' (обработанный тайл),
+    'organizations' (найденные или дополненные организации с позициями).
+    Соединение закрывается через EVENT_STREAM_MAX_SECONDS, чтобы не занимать
+    поток воркера: EventSource переподключается сам и по Last-Event-ID
+    продолжает с первого непрочитанного события.
+    """
+    job_id = request.args.get('job_id', '').strip() or None
+    client = None if job_id else client_id()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Неверный Last-Event-ID'}), 400
+    if job_id and job_registry.get(job_id) is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    if last_event_id is None:
+        last_event_id = 0 if job_id else job_registry.last_event_id()
+    
+    def generate():
+        after = last_event_id
+        deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+        last_sent = time.monotonic()
+        yield f"retry: {EVENT_STREAM_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            # Состояние читаем до событий: событие о завершении записано вместе с ним
+            finished = job_id and job_registry.get(job_id)['state'] not in JOB_ACTIVE_STATES
+            events = job_registry.events(after, job_id=job_id, client=client)
+            for event_id, event_job, event, data in events:
+                after = event_id
+                yield format_sse(event, dict(data, job_id=event_job), event_id)
+            if events:
+                last_sent = time.monotonic()
+                continue
+            if finished:
+                yield format_sse('end', {'job_id': job_id})
+                return
+            if time.monotonic() - last_sent >= EVENT_STREAM_HEARTBEAT:
+                # Комментарий не доставляется клиенту, но обнаруживает закрытые соединения
+                yield ': ping\n\n'
+                last_sent = time.monotonic()
+            time.sleep(EVENT_STREAM_POLL_INTERVAL)
+    
+    return app.response_class(generate(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/get_status', methods=['GET'])
 def get_status():
+    job_id = request.args.get('job_id', '').strip()
+    if job_id:
+        job = job_registry.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Задача не найдена'}), 404
+        if job['state'] == 'queued':
+            job.update(job_registry.queue_status()['estimates'].get(job_id, {}))
+        return jsonify({'job': job})
+    
+    job_scheduler.ensure_started()
+    queue_status = job_registry.queue_status()
+    client = client_id()
+    active_jobs = job_registry.active()
+    for job in active_jobs:
+        job.update(queue_status['estimates'].get(job['id'], {}))
+    last_search = job_registry.latest('search_names', client=client)
     return jsonify({
-        'processes': current_processes,
-        'organizations_count': len(organizations_data)
+        'processes': {kind: any(job['kind'] == kind and job['client'] == client for job in active_jobs)
+                      for kind in JOB_KINDS},
+        'jobs': active_jobs,
+        'queue': {name: queue_status[name] for name in ('running', 'depth', 'slots')},
+        'organizations_count': last_search['found'] if last_search else 0,
+        'response_cache': response_cache.get_stats(),
+        'email_cache': email_cache.get_stats(),
+        'dataset_cache': dataset_cache.get_stats()
     })
 
 if __name__ == '__main__':
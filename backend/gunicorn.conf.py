@@ -6,7 +6,9 @@ import multiprocessing
 # Базовые настройки
 bind = "0.0.0.0:5000"
 workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
-worker_class = "sync"
+# Потоковые воркеры: длинные соединения /api/events занимают поток, а не весь процесс
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
 worker_connections = 1000
 timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
 keepalive = 2
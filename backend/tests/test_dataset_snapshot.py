@@ -0,0 +1,96 @@
+"""Проверка колоночных снимков наборов данных.
+
+Запуск из корня репозитория: python -m unittest discover -s backend/tests
+"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+from collections import Counter
+
+from werkzeug.datastructures import MultiDict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Хранилища приложения создаются при импорте: держим их во временном каталоге
+os.chdir(tempfile.mkdtemp(prefix='resort_search_tests_'))
+
+import app  # noqa: E402
+
+TYPES = ['гостиница', 'хостел', 'санаторий']
+
+def make_organizations(count, seed=1):
+    random.seed(seed)
+    organizations = []
+    for i in range(count):
+        coordinates = [] if i % 7 == 0 else [38 + random.random(), 44 + random.random()]
+        organizations.append(app.Organization(
+            name=f'Отель «Морской» {i}',
+            coordinates=coordinates,
+            yandex_id=str(1000 + i),
+            full_address='' if i % 5 == 0 else f'Анапа, ул. Морская, {i}',
+            website=random.choice(['', 'https://morskoy.ru']),
+            email=random.choice(['', 'info@morskoy.ru', app.EMAIL_NOT_FOUND]),
+            type=TYPES[i % len(TYPES)],
+            city=random.choice([None, 'Анапа']),
+        ))
+    return organizations
+
+class DatasetSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='snapshots_')
+
+    def write(self, organizations):
+        path = os.path.join(self.directory, f'{len(organizations)}.snap')
+        app.DatasetSnapshot.write(path, organizations)
+        return app.DatasetSnapshot(path, version=1)
+
+    def test_round_trip(self):
+        organizations = make_organizations(300)
+        snapshot = self.write(organizations)
+        self.assertEqual(len(snapshot), len(organizations))
+        self.assertEqual(snapshot.select(), organizations)
+        without_coordinates = snapshot.select()[0]
+        self.assertIsNone(without_coordinates.lon)
+        self.assertEqual(without_coordinates.coordinates, [])
+        self.assertEqual(snapshot.count_by_type(), dict(Counter(org.type for org in organizations)))
+
+    def test_empty_dataset(self):
+        snapshot = self.write([])
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(snapshot.select(), [])
+        self.assertEqual(snapshot.count_by_type(), {})
+        self.assertEqual(snapshot.select_page(cursor=0, limit=10), ([], None))
+
+    def test_select_page_matches_list(self):
+        organizations = make_organizations(1000, seed=2)
+        snapshot = self.write(organizations)
+        queries = [
+            {},
+            {'type': 'хостел'},
+            {'type': 'гостиница,санаторий', 'has_email': '1'},
+            {'has_email': '0'},
+            {'bbox': '44.2,38.2,44.6,38.7'},
+            {'type': 'хостел', 'bbox': '44.0,38.0,45.0,39.0', 'has_email': '1'},
+        ]
+        for query in queries:
+            types, matches = app.organization_filter(MultiDict(query))
+            for cursor, limit in [(0, None), (0, 25), (137, 40), (990, 50), (1000, 10)]:
+                with self.subTest(query=query, cursor=cursor, limit=limit):
+                    expected = app.select_page(organizations, types, matches, cursor, limit)
+                    self.assertEqual(snapshot.select_page(types, matches, cursor, limit), expected)
+
+    def test_pages_follow_cursor_to_the_end(self):
+        organizations = make_organizations(500, seed=3)
+        snapshot = self.write(organizations)
+        types, matches = app.organization_filter(MultiDict({'type': 'санаторий', 'has_email': '1'}))
+        collected, cursor = [], 0
+        while cursor is not None:
+            page, cursor = snapshot.select_page(types, matches, cursor, 7)
+            collected.extend(page)
+        self.assertEqual(collected, [org for org in organizations if org.type == 'санаторий' and matches(org)])
+
+if __name__ == '__main__':
+    unittest.main()
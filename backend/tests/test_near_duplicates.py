@@ -0,0 +1,51 @@
+"""Проверка поиска почти-дубликатов по сетке ячеек.
+
+Запуск из корня репозитория: python -m unittest discover -s backend/tests
+"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Хранилища приложения создаются при импорте: держим их во временном каталоге
+os.chdir(tempfile.mkdtemp(prefix='resort_search_tests_'))
+
+import app  # noqa: E402
+
+class NearDuplicateDetectorTest(unittest.TestCase):
+    def test_finds_close_point_across_cell_boundary(self):
+        # Точки в 47.6 м друг от друга, раньше попадавшие в ячейки через одну
+        detector = app.NearDuplicateDetector(distance_m=50)
+        detector.add(38.129686, 44.573503, 'морской', 'ул морская 5')
+        self.assertLess(app.distance_km(38.129686, 44.573503, 38.130273, 44.573412), 0.05)
+        self.assertIsNotNone(detector.find(38.130273, 44.573412, 'морской', 'ул морская 5'))
+
+    def test_matches_brute_force_at_different_latitudes(self):
+        random.seed(7)
+        detector = app.NearDuplicateDetector(distance_m=50)
+        points = []
+        for _ in range(2000):
+            # Один детектор на область в несколько градусов широты
+            lon, lat = 38 + random.uniform(-2, 2), 44 + random.uniform(-3, 3)
+            detector.add(lon, lat, 'морской', '')
+            points.append((lon, lat))
+        for lon, lat in points[:500]:
+            for _ in range(3):
+                other_lon = lon + random.uniform(-0.0008, 0.0008)
+                other_lat = lat + random.uniform(-0.0005, 0.0005)
+                near = any(app.distance_km(other_lon, other_lat, p_lon, p_lat) <= 0.05 for p_lon, p_lat in points)
+                found = detector.find(other_lon, other_lat, 'морской', '') is not None
+                self.assertEqual(found, near, (other_lon, other_lat))
+
+    def test_far_or_different_points_are_not_duplicates(self):
+        detector = app.NearDuplicateDetector(distance_m=50)
+        detector.add(38.0, 44.5, 'морской', 'ул морская 5')
+        self.assertIsNone(detector.find(38.001, 44.5, 'морской', 'ул морская 5'))
+        self.assertIsNone(detector.find(38.0001, 44.5, 'пляж', 'ул морская 7'))
+
+if __name__ == '__main__':
+    unittest.main()
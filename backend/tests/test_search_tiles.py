@@ -0,0 +1,79 @@
+"""Проверка покрытия круга поиска тайлами с учетом ранее просмотренных кругов.
+
+Запуск из корня репозитория: python -m unittest discover -s backend/tests
+"""
+import math
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Хранилища приложения создаются при импорте: держим их во временном каталоге
+os.chdir(tempfile.mkdtemp(prefix='resort_search_tests_'))
+
+import app  # noqa: E402
+
+RADIUS = 5.0
+
+def in_tile(tile, x, y):
+    return abs(x - tile.x_km) <= tile.half_km and abs(y - tile.y_km) <= tile.half_km
+
+def in_circle(circle, x, y):
+    return math.hypot(x - circle[0], y - circle[1]) <= circle[2]
+
+def points_in_search_circle(count=3000, seed=5):
+    random.seed(seed)
+    points = []
+    while len(points) < count:
+        x, y = random.uniform(-RADIUS, RADIUS), random.uniform(-RADIUS, RADIUS)
+        if math.hypot(x, y) <= RADIUS:
+            points.append((x, y))
+    return points
+
+class PlanTilesTest(unittest.TestCase):
+    def test_without_coverage_whole_circle_is_requested(self):
+        self.assertEqual(app.plan_tiles(RADIUS, []), [app.SearchTile(0.0, 0.0, RADIUS)])
+
+    def test_fully_covered_circle_needs_no_requests(self):
+        self.assertEqual(app.plan_tiles(RADIUS, [(0.0, 0.0, RADIUS)]), [])
+        # Больший круг со смещенным центром, целиком содержащий круг поиска
+        self.assertEqual(app.plan_tiles(RADIUS, [(1.0, -1.0, RADIUS + 2)]), [])
+
+    def test_partial_coverage_requests_only_uncovered_parts(self):
+        covered = (RADIUS, 0.0, RADIUS)
+        tiles = app.plan_tiles(RADIUS, [covered])
+        self.assertTrue(tiles)
+        self.assertNotEqual(tiles, [app.SearchTile(0.0, 0.0, RADIUS)])
+        for tile in tiles:
+            self.assertFalse(app.tile_covered(tile, RADIUS, covered), tile)
+        # Каждая точка круга поиска либо в просмотренном круге, либо в запрошенном тайле
+        for x, y in points_in_search_circle():
+            self.assertTrue(in_circle(covered, x, y) or any(in_tile(tile, x, y) for tile in tiles), (x, y))
+        # Западная половина круга не просмотрена и должна запрашиваться целиком
+        self.assertTrue(all(any(in_tile(tile, x, y) for tile in tiles)
+                            for x, y in points_in_search_circle(seed=6) if x < 0))
+
+    def test_tiles_stay_within_depth_and_size_limits(self):
+        tiles = app.plan_tiles(RADIUS, [(2.0, 3.0, 2.5), (-3.0, -1.0, 1.5)], depth=2)
+        self.assertTrue(tiles)
+        for tile in tiles:
+            self.assertGreaterEqual(tile.half_km, RADIUS / 4)
+            self.assertGreaterEqual(tile.half_km, app.SEARCH_MIN_TILE_KM)
+
+class TileCoveredTest(unittest.TestCase):
+    def test_tile_inside_covered_circle(self):
+        tile = app.SearchTile(1.0, 1.0, 0.5)
+        self.assertTrue(app.tile_covered(tile, RADIUS, (1.0, 1.0, 1.0)))
+        self.assertFalse(app.tile_covered(tile, RADIUS, (1.0, 1.0, 0.5)))
+
+    def test_part_outside_search_circle_is_ignored(self):
+        # Угол тайла вне круга поиска не требует покрытия: достаточно, чтобы был покрыт весь круг поиска
+        tile = app.SearchTile(0.0, 0.0, RADIUS)
+        self.assertTrue(app.tile_covered(tile, RADIUS, (0.0, 0.0, RADIUS)))
+
+if __name__ == '__main__':
+    unittest.main()
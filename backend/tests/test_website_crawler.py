@@ -0,0 +1,95 @@
+"""Проверка поиска email на сайтах организаций против локальной подмены HTTP.
+
+Запуск из корня репозитория: python -m unittest discover -s backend/tests
+"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Хранилища приложения создаются при импорте: держим их во временном каталоге
+WORK_DIR = tempfile.mkdtemp(prefix='resort_search_tests_')
+os.chdir(WORK_DIR)
+
+import app  # noqa: E402
+
+# Страницы подменных сайтов: {хост: {путь: HTML}}
+SITES = {
+    'morskoy-hotel.ru': {
+        '/': '<a href="mailto:booking@partner-agency.ru">Партнер</a>',
+        '/contacts': '<p>Пишите нам: info@morskoy-hotel.ru</p>',
+    },
+    'foreign-only.ru': {
+        '/': '<p>Бронирование: sales@unrelated-site.ru</p>',
+    },
+    'hotelplaza.ru': {
+        '/': '<p>info@hotelplaza.ru</p>',
+    },
+}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Подменный сайт: принимает запросы как HTTP-прокси и отвечает страницами из SITES"""
+    requested = []
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        self.requested.append(parts.netloc + parts.path)
+        page = SITES.get(parts.netloc, {}).get(parts.path or '/')
+        if page is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = f'<html><body>{page}</body></html>'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class WebsiteCrawlerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StandInHandler.requested.clear()
+        self.crawler = app.WebsiteCrawler(workers=4, per_host=2, host_delay=0, timeout=(1, 1))
+        self.crawler.session.trust_env = False
+        proxy = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.crawler.session.proxies = {'http': proxy}
+
+    def organization(self, name, website):
+        return app.Organization(name=name, coordinates=[37.3, 44.9], yandex_id='1', website=website)
+
+    def test_prefers_email_on_site_domain(self):
+        found = self.crawler.crawl_many({0: self.organization('Морской', 'http://morskoy-hotel.ru/')})
+        self.assertEqual(found, {0: 'info@morskoy-hotel.ru'})
+
+    def test_ignores_emails_on_other_domains(self):
+        found = self.crawler.crawl_many({0: self.organization('Форин', 'http://foreign-only.ru')})
+        self.assertEqual(found, {})
+        self.assertIn('foreign-only.ru/', StandInHandler.requested)
+
+    def test_skips_placeholder_websites(self):
+        org = self.organization('Hotel Plaza', app.placeholder_website('Hotel Plaza'))
+        self.assertEqual(org.website, 'https://hotelplaza.ru')
+        self.assertEqual(self.crawler.crawl_many({0: org}), {})
+        self.assertEqual(StandInHandler.requested, [])
+
+if __name__ == '__main__':
+    unittest.main()